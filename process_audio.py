@@ -9,6 +9,7 @@ import time
 import queue
 import shutil
 import subprocess
+import threading
 from datetime import datetime
 
 # 导入我们修改过的三个脚本中的函数
@@ -73,7 +74,8 @@ def convert_video_to_mp3(video_path, output_dir=None, progress_queue=None):
     
     try:
         # 使用ffmpeg将视频转换为MP3
-        cmd = ["ffmpeg", "-i", video_path, "-q:a", "0", "-map", "a", "-vn", mp3_path, "-y"]
+        cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-nostats",
+               "-i", video_path, "-q:a", "0", "-map", "a", "-vn", mp3_path, "-y"]
         status_msg = f"执行命令: {' '.join(cmd)}"
         if progress_queue:
             progress_queue.put(status_msg)
@@ -139,6 +141,8 @@ def run_pipeline(params, progress_queue=None, control_queue=None):
     audio_chunks_dir = params.get('audio_chunks_dir', None)  # 新增：自定义音频切片目录
     max_workers = params.get('max_workers', DEFAULT_MAX_WORKERS)  # 新增：最大并行请求数
     skip_existing = params.get('skip_existing', True)  # 新增：断点续传，是否跳过已存在的转录文件
+    pipeline_overlap = params.get('pipeline_overlap', False)  # 新增：切分与转录流水线并行
+    batch_size = params.get('batch_size', 1)  # 新增：每次请求携带的切片数
 
     # 验证必要参数
     if not input_file or not os.path.isfile(input_file):
@@ -211,8 +215,89 @@ def run_pipeline(params, progress_queue=None, control_queue=None):
     srt_file = os.path.join(output_dir, f"{input_path.stem}.srt")
     
     # 1. 切分音频（根据skip_split参数决定是否执行）
+    # 流水线并行模式：切分和转录重叠执行，切片一生成就立即送去转录
+    overlap = pipeline_overlap and not skip_split
+    transcription_success = False
     chunk_files = []
-    if not skip_split:
+    if overlap:
+        start_msg = (f"\n--- 步骤 1+2: 切分与转录流水线并行 (最大长度: {max_length}秒, "
+                     f"目标语言: {target_language}, 模型: {model_name}) ---")
+        if progress_queue:
+            progress_queue.put(start_msg)
+        print(start_msg)
+
+        overlap_start = time.time()
+        try:
+            from transcript import get_system_instruction
+            custom_system_instruction = get_system_instruction(target_language)
+
+            chunk_q = queue.Queue()
+            split_result = {}
+
+            def _split_producer():
+                """后台线程：执行切分，把切片路径实时放入队列"""
+                try:
+                    split_result['chunks'] = split_audio(
+                        input_audio,
+                        audio_chunk_dir,
+                        max_chunk_length=max_length * 1000,  # 转为毫秒
+                        min_silence_len=silence_length,
+                        silence_thresh=silence_threshold,
+                        chunk_queue=chunk_q
+                    )
+                except Exception as e:
+                    split_result['error'] = e
+                finally:
+                    chunk_q.put(None)  # 结束哨兵，通知转录端切分已完成
+
+            split_thread = threading.Thread(target=_split_producer, daemon=True)
+            split_thread.start()
+
+            # 转录端以流式方式消费队列，与切分重叠执行
+            transcription_success = run_transcription(
+                api_key=api_key,
+                audio_dir=audio_chunk_dir,
+                intermediate_dir=intermediate_dir,
+                system_instruction=custom_system_instruction,
+                model_name=model_name,
+                progress_queue=progress_queue,
+                max_workers=max_workers,
+                skip_existing=skip_existing,
+                chunk_queue=chunk_q
+            )
+            split_thread.join()
+
+            if 'error' in split_result:
+                raise split_result['error']
+            chunk_files = split_result.get('chunks') or []
+
+            if not chunk_files:
+                error_msg = "错误：音频切分失败，未生成音频片段。"
+                if progress_queue:
+                    progress_queue.put(error_msg)
+                print(error_msg)
+                return False
+
+            if not transcription_success:
+                error_msg = "错误：音频转录失败。"
+                if progress_queue:
+                    progress_queue.put(error_msg)
+                print(error_msg)
+                return False
+
+            overlap_end = time.time()
+            success_msg = (f"切分与转录流水线完成，生成了 {len(chunk_files)} 个音频片段。"
+                           f"耗时: {overlap_end - overlap_start:.2f}秒")
+            if progress_queue:
+                progress_queue.put(success_msg)
+            print(success_msg)
+        except Exception as e:
+            error_msg = f"切分与转录流水线过程中发生错误: {e}"
+            if progress_queue:
+                progress_queue.put(error_msg)
+            print(error_msg)
+            return False
+    elif not skip_split:
         start_msg = f"\n--- 步骤 1: 切分音频 (最大长度: {max_length}秒, 静音长度: {silence_length}毫秒, 静音阈值: {silence_threshold}dB) ---"
         if progress_queue:
             progress_queue.put(start_msg)
@@ -281,48 +366,50 @@ def run_pipeline(params, progress_queue=None, control_queue=None):
             print(error_msg)
             return False
     
-    # 2. 转录音频
-    start_msg = f"\n--- 步骤 2: 转录音频片段 (目标语言: {target_language}, 模型: {model_name}) ---" # 更新日志信息
-    if progress_queue:
-        progress_queue.put(start_msg)
-    print(start_msg)
-    
-    step2_start = time.time()
-    try:
-        # 使用目标语言生成系统指令
-        from transcript import get_system_instruction
-        custom_system_instruction = get_system_instruction(target_language)
-        
-        # 调用transcript.py中的run_transcription函数，传入自定义的system_instruction
-        transcription_success = run_transcription(
-            api_key=api_key,
-            audio_dir=audio_chunk_dir,
-            intermediate_dir=intermediate_dir,
-            system_instruction=custom_system_instruction,
-            model_name=model_name, # 传递模型名称
-            progress_queue=progress_queue,
-            max_workers=max_workers, # 传递并行处理数
-            skip_existing=skip_existing # 新增：传递断点续传参数
-        )
-        
-        if not transcription_success:
-            error_msg = "错误：音频转录失败。"
+    # 2. 转录音频（流水线并行模式下已与切分一起完成）
+    if not overlap:
+        start_msg = f"\n--- 步骤 2: 转录音频片段 (目标语言: {target_language}, 模型: {model_name}) ---" # 更新日志信息
+        if progress_queue:
+            progress_queue.put(start_msg)
+        print(start_msg)
+
+        step2_start = time.time()
+        try:
+            # 使用目标语言生成系统指令
+            from transcript import get_system_instruction
+            custom_system_instruction = get_system_instruction(target_language)
+
+            # 调用transcript.py中的run_transcription函数，传入自定义的system_instruction
+            transcription_success = run_transcription(
+                api_key=api_key,
+                audio_dir=audio_chunk_dir,
+                intermediate_dir=intermediate_dir,
+                system_instruction=custom_system_instruction,
+                model_name=model_name, # 传递模型名称
+                progress_queue=progress_queue,
+                max_workers=max_workers, # 传递并行处理数
+                skip_existing=skip_existing, # 新增：传递断点续传参数
+                batch_size=batch_size # 新增：传递批量请求大小
+            )
+
+            if not transcription_success:
+                error_msg = "错误：音频转录失败。"
+                if progress_queue:
+                    progress_queue.put(error_msg)
+                print(error_msg)
+                return False
+
+            step2_end = time.time()
+            success_msg = f"音频转录完成。耗时: {step2_end - step2_start:.2f}秒"
+            if progress_queue:
+                progress_queue.put(success_msg)
+            print(success_msg)
+        except Exception as e:
+            error_msg = f"音频转录过程中发生错误: {e}"
             if progress_queue:
                 progress_queue.put(error_msg)
             print(error_msg)
             return False
-            
-        step2_end = time.time()
-        success_msg = f"音频转录完成。耗时: {step2_end - step2_start:.2f}秒"
-        if progress_queue:
-            progress_queue.put(success_msg)
-        print(success_msg)
-    except Exception as e:
-        error_msg = f"音频转录过程中发生错误: {e}"
-        if progress_queue:
-            progress_queue.put(error_msg)
-        print(error_msg)
-        return False
     
     # 3. 合并转录生成SRT
     start_msg = f"\n--- 步骤 3: 合并转录生成SRT字幕 (内容类型: {content}, 第一块偏移: {first_chunk_offset}秒) ---"
@@ -521,6 +608,14 @@ def main():
     parser.add_argument("--no-skip-existing", action="store_false", dest="skip_existing",
                       help="禁用断点续传功能，不跳过已有的中间转录文件")
 
+    # 新增：流水线并行参数
+    parser.add_argument("--pipeline-overlap", action="store_true",
+                      help="切分与转录流水线并行：切片一生成就立即送去转录，缩短总耗时")
+
+    # 新增：批量请求参数
+    parser.add_argument("--batch-size", type=int, default=1,
+                      help="转录时每次请求携带的切片数 (默认: 1)。>1 时多个切片合并为一次请求，摊薄请求开销。")
+
     # 其他选项
     parser.add_argument("--cleanup", action="store_true",
                       help="处理完成后删除中间文件")
@@ -6,18 +6,109 @@ import math
 import time
 import argparse # Keep argparse for potential standalone use, though process_audio.py is the main entry point
 import sys
+import concurrent.futures # 导入并行处理库，用于并行导出切片
+import shutil
+import json
+import tempfile
+import atexit
+try:
+    import numpy as np # 可选依赖：用于向量化计算静音中点（数千个静音段时明显更快）
+except ImportError:
+    np = None
 
 # --- 配置 (保持与原文件一致，但注意单位转换) ---
 OUTPUT_DIR = "temp_audio_chunks_new_api"  # 默认输出目录
 MAX_CHUNK_LENGTH_SEC = 5 * 60  # 最大切片长度（秒，默认5分钟）
 MIN_SILENCE_LENGTH_SEC = 0.5 # 最小静音长度（秒，默认0.5秒）
 SILENCE_THRESH_DB = -40  # 静音阈值（dB，默认-40）
+MAX_EXPORT_WORKERS = min(os.cpu_count() or 4, 4)  # 并行导出切片的最大进程数（4个ffmpeg进程左右已接近最优）
 # -------------
 
+# 预编译的 silencedetect 输出解析正则（字节级，一次匹配 start/end 两种行，避免逐行解码和两次正则搜索）
+_SILENCE_RE = re.compile(rb'silence_(start|end): (\d+\.?\d*)')
+
+# --- ffprobe 时长磁盘缓存 ---
+# 同一个文件在切分、合并、校验等阶段会被反复探测；按 (路径, mtime, 大小) 缓存结果，
+# 热缓存时把一次 ffprobe 子进程（约50-200ms）变成一次字典查找。
+_DURATION_CACHE_PATH = pathlib.Path('~/.cache/trans_trans/durations.json').expanduser()
+_duration_cache = None
+_duration_cache_dirty = False
+
+def _get_duration_cache():
+    """延迟加载时长缓存（只在首次使用时读取磁盘）"""
+    global _duration_cache
+    if _duration_cache is None:
+        try:
+            with open(_DURATION_CACHE_PATH, 'r', encoding='utf-8') as f:
+                _duration_cache = json.load(f)
+        except (OSError, ValueError):
+            _duration_cache = {}
+        atexit.register(_save_duration_cache)
+    return _duration_cache
+
+def _save_duration_cache():
+    """原子地保存时长缓存（tmp文件 + rename），失败不影响主流程"""
+    if not _duration_cache_dirty:
+        return
+    try:
+        _DURATION_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(_DURATION_CACHE_PATH.parent), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(_duration_cache, f)
+        os.replace(tmp_path, _DURATION_CACHE_PATH)
+    except OSError:
+        pass
+
+def _duration_cache_key(input_file):
+    """生成缓存键 (路径, mtime, 大小)；文件不可访问时返回 None"""
+    try:
+        stat = os.stat(input_file)
+    except OSError:
+        return None
+    return f"{os.path.abspath(input_file)}:{stat.st_mtime}:{stat.st_size}"
+
+def _export_chunk(export_job):
+    """导出单个音频切片（供并行调用）。
+
+    Args:
+        export_job (tuple): (切片描述信息, ffmpeg命令, 切片文件路径)
+
+    Returns:
+        str 或 None: 成功时返回切片文件路径，失败时返回 None
+    """
+    description, command_split, chunk_filename = export_job
+    print(description)
+    try:
+        # 运行ffmpeg命令
+        subprocess.run(command_split, check=True, capture_output=True, text=True, timeout=300) # Add timeout
+        return chunk_filename
+    except FileNotFoundError:
+        # 关键错误，向上抛出以停止整个切分过程
+        raise
+    except subprocess.CalledProcessError as e:
+        print(f"  错误：ffmpeg 导出片段 {chunk_filename} 失败。")
+        print(f"  命令: {' '.join(e.cmd)}")
+        print(f"  返回码: {e.returncode}")
+        print(f"  错误输出: {e.stderr}")
+        return None
+    except subprocess.TimeoutExpired:
+        print(f"错误：ffmpeg 导出片段 {chunk_filename} 超时。")
+        return None
+    except Exception as e:
+        print(f"  导出片段 {chunk_filename} 时发生未知错误: {e}")
+        return None
+
 def get_audio_duration_ffmpeg(input_file):
-    """使用 ffprobe 获取音频时长（秒）"""
+    """使用 ffprobe 获取音频时长（秒），结果按 (路径, mtime, 大小) 做磁盘缓存"""
+    global _duration_cache_dirty
+    cache = _get_duration_cache()
+    cache_key = _duration_cache_key(input_file)
+    if cache_key is not None and cache_key in cache:
+        return cache[cache_key]
+
     command = [
         'ffprobe',
+        '-hide_banner', # 不输出版本信息，减少stderr量
         '-v', 'error',
         '-show_entries', 'format=duration',
         '-of', 'default=noprint_wrappers=1:nokey=1',
@@ -30,7 +121,11 @@ def get_audio_duration_ffmpeg(input_file):
              print(f"错误：ffprobe 获取时长失败。命令: {' '.join(command)}")
              print(f"ffprobe 输出: {stderr_output}")
              return None
-        return float(stdout_output.strip())
+        duration = float(stdout_output.strip())
+        if cache_key is not None:
+            cache[cache_key] = duration
+            _duration_cache_dirty = True
+        return duration
     except FileNotFoundError:
         print("错误: ffprobe 命令未找到。请确保 ffmpeg (包含 ffprobe) 已安装并添加到系统 PATH。")
         return None
@@ -48,44 +143,45 @@ def detect_silence_with_ffmpeg(input_file, min_silence_duration_sec, noise_toler
     print(f"使用 ffmpeg 检测静音 (阈值: {noise_tolerance_db}dB, 最小静音长度: {min_silence_duration_sec}s)...")
     command = [
         'ffmpeg',
+        '-hide_banner', # 不输出版本信息
+        '-nostdin',     # 不从stdin读取，避免挂起
+        '-nostats',     # 不输出进度行，silencedetect 结果仍走 info 级别日志
         '-i', input_file,
         '-af', f'silencedetect=noise={noise_tolerance_db}dB:d={min_silence_duration_sec}',
         '-f', 'null', '-' # 不输出文件，只分析
     ]
     silence_points_sec = []
-    try:
-        process = subprocess.Popen(command, stderr=subprocess.PIPE, universal_newlines=True)
-        stderr_output = ""
-        # Read stderr line by line to avoid large memory usage for long outputs
-        for line in process.stderr:
-             stderr_output += line
-             # Parse start and end times as they appear
-             start_match = re.search(r'silence_start: (\d+\.?\d*)', line)
-             if start_match:
-                 # Store start time temporarily, waiting for end time
-                 current_start = float(start_match.group(1))
-             end_match = re.search(r'silence_end: (\d+\.?\d*)', line)
-             if end_match and 'current_start' in locals():
-                 current_end = float(end_match.group(1))
-                 # Ensure start is before end, sometimes ffmpeg might output them close together
-                 if current_end > current_start:
-                     silence_points_sec.append((current_start, current_end))
-                 del current_start # Reset for the next pair
-
-        process.wait(timeout=300) # Wait for ffmpeg to finish, with timeout
 
+    def _consume(data):
+        """解析stderr字节流中的所有静音标记（配对 start/end）"""
+        current_start = None # 暂存 silence_start，等待配对的 silence_end
+        for match in _SILENCE_RE.finditer(data):
+            if match.group(1) == b'start':
+                current_start = float(match.group(2))
+            elif current_start is not None:
+                current_end = float(match.group(2))
+                # Ensure start is before end, sometimes ffmpeg might output them close together
+                if current_end > current_start:
+                    silence_points_sec.append((current_start, current_end))
+                current_start = None # Reset for the next pair
+
+    try:
+        # 开启 -nostats 后 stderr 只剩少量 silencedetect 信息行，直接一次性捕获再解析即可；
+        # subprocess.run 由C层排空管道（无死锁风险），超时时自行杀死并回收子进程（无僵尸进程）
+        process = subprocess.run(command, capture_output=True, timeout=300)
         if process.returncode != 0:
              print(f"警告：ffmpeg silencedetect 执行可能出错 (返回码: {process.returncode})。命令: {' '.join(command)}")
              # Continue with potentially partial results
+        _consume(process.stderr)
 
     except FileNotFoundError:
         print("错误: ffmpeg 命令未找到。请确保 ffmpeg 已安装并添加到系统 PATH。")
         return [] # Return empty list on critical error
-    except subprocess.TimeoutExpired:
+    except subprocess.TimeoutExpired as e:
         print(f"错误：ffmpeg silencedetect 超时: {input_file}")
-        if process:
-            process.kill()
-        # Return potentially partial results found so far
+        # subprocess.run 已终止并回收子进程；解析超时前已产生的部分输出
+        if e.stderr:
+            _consume(e.stderr)
     except Exception as e:
         print(f"错误：使用 ffmpeg silencedetect 时发生未知错误: {e}")
         return [] # Return empty list on critical error
@@ -104,9 +200,17 @@ def find_optimal_split_points_sec(audio_length_sec, silence_points_sec, max_chun
     current_chunk_start = 0.0
     last_silence_midpoint = -1.0 # Track the last suitable silence midpoint
 
+    # 预先批量计算所有静音段的起点和中点：
+    # 有 numpy 时一次性在 C 层完成，避免对数千个静音段逐个做 Python 算术
+    if np is not None and silence_points_sec:
+        silence_array = np.asarray(silence_points_sec, dtype=np.float64)
+        silence_pairs = zip(silence_array[:, 0].tolist(), silence_array.mean(axis=1).tolist())
+    else:
+        silence_pairs = ((start_sec, (start_sec + end_sec) / 2.0)
+                         for start_sec, end_sec in silence_points_sec)
+
     # Iterate through silence periods to find good split points
-    for start_sec, end_sec in silence_points_sec:
-        silence_midpoint = (start_sec + end_sec) / 2.0
+    for start_sec, silence_midpoint in silence_pairs:
         potential_chunk_len = silence_midpoint - current_chunk_start
 
         # If adding this silence midpoint doesn't exceed max length, consider it
@@ -167,9 +271,97 @@ def find_optimal_split_points_sec(audio_length_sec, silence_points_sec, max_chun
     return split_points_sec
 
 
+def _compute_chunk_spans(input_file, max_chunk_length_sec, min_silence_len_sec, silence_thresh_db):
+    """计算切分区间列表 [(start_sec, end_sec), ...]；无法获取时长时返回 None"""
+    print(f"加载音频信息: {input_file}")
+    total_length_sec = get_audio_duration_ffmpeg(input_file)
+    if total_length_sec is None:
+        print(f"错误：无法获取音频时长，无法继续切分 {input_file}")
+        return None
+    print(f"音频总长度: {total_length_sec:.2f} 秒 ({total_length_sec/60:.2f} 分钟)")
+
+    # 检测静音点 (使用ffmpeg)
+    silence_points_sec = detect_silence_with_ffmpeg(input_file, min_silence_len_sec, silence_thresh_db)
+
+    # 计算切分点 (使用ffmpeg检测到的静音点)
+    split_points_sec = find_optimal_split_points_sec(total_length_sec, silence_points_sec, max_chunk_length_sec)
+
+    chunk_spans = []
+    start_time_sec = 0.0
+    for end_time_sec in split_points_sec:
+        # 确保切片有有效长度
+        if end_time_sec <= start_time_sec + 0.01: # 增加一个小的阈值避免零长度或极短片段
+            print(f"  跳过无效切分点: {start_time_sec:.2f}s -> {end_time_sec:.2f}s")
+            continue
+        chunk_spans.append((start_time_sec, end_time_sec))
+        start_time_sec = end_time_sec # 更新下一个片段的起始时间
+    return chunk_spans
+
+def _build_extract_command(input_file, start_time_sec, duration_sec):
+    """构造提取单个片段的 ffmpeg 命令（不含输出部分）。
+
+    -ss 放在 -i 之前做输入端快速定位（利用容器索引，配合 -c copy 近乎瞬时），
+    放在 -i 之后会导致每个片段都从0开始解码到起始点，越靠后的片段越慢。
+    """
+    return [
+        'ffmpeg',
+        '-hide_banner', '-nostdin', '-nostats', # 静默模式：不输出banner/进度，减少stderr I/O
+        '-ss', str(start_time_sec), # 起始时间（输入端定位）
+        '-i', input_file,
+        '-t', str(duration_sec),    # 片段时长（输入端定位后 -to 相对于定位点，故改用 -t）
+        '-c', 'copy',             # 直接复制流，速度快 (如果输入是MP3)
+        # '-acodec', 'libmp3lame', '-ab', '192k', # 如果需要重新编码，取消注释并调整参数
+        '-map_metadata', '-1',    # 去除元数据，避免潜在问题
+        '-avoid_negative_ts', 'make_zero', # 输入端定位后修正时间戳，避免负时间戳
+        '-loglevel', 'error',     # 只显示错误信息
+    ]
+
+def iter_chunk_bytes(input_file, max_chunk_length=MAX_CHUNK_LENGTH_SEC * 1000,
+                     min_silence_len=int(MIN_SILENCE_LENGTH_SEC * 1000), silence_thresh=SILENCE_THRESH_DB):
+    """以内存流方式切分音频：每个切片经 ffmpeg 管道 (pipe:1) 直接输出为 MP3 字节，
+    不写任何切片文件，适合"切分后立即上传"的场景（如把切片字节内联发给 Gemini），
+    省去每个切片一次写盘+读盘。
+
+    注意：标准流水线仍使用 split_audio 写出切片文件，因为 combine_transcripts
+    需要读取每个切片文件的时长来累计字幕时间偏移。
+
+    Args:
+        input_file (str): 输入音频文件的路径
+        max_chunk_length (int): 最大切片长度（毫秒）
+        min_silence_len (int): 最小静音长度（毫秒）
+        silence_thresh (int): 静音阈值（dB）
+
+    Yields:
+        tuple: (切片文件名, 切片MP3字节, 切片时长秒)
+    """
+    chunk_spans = _compute_chunk_spans(input_file, max_chunk_length / 1000.0,
+                                       min_silence_len / 1000.0, silence_thresh)
+    if chunk_spans is None:
+        return
+
+    for i, (start_time_sec, end_time_sec) in enumerate(chunk_spans):
+        chunk_name = f"chunk_{i+1:03d}.mp3"
+        duration_sec = end_time_sec - start_time_sec
+        print(f"提取片段 {i+1}/{len(chunk_spans)}: {start_time_sec:.2f}s - {end_time_sec:.2f}s "
+              f"({duration_sec:.2f}s) -> 内存 ({chunk_name})")
+        command = _build_extract_command(input_file, start_time_sec, duration_sec) + ['-f', 'mp3', 'pipe:1']
+        try:
+            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=300)
+        except FileNotFoundError:
+            print("错误: ffmpeg 命令未找到。请确保 ffmpeg 已安装并添加到系统 PATH。")
+            return
+        except subprocess.TimeoutExpired:
+            print(f"错误：ffmpeg 提取片段 {chunk_name} 超时。")
+            continue
+        if process.returncode != 0 or not process.stdout:
+            print(f"  错误：ffmpeg 提取片段 {chunk_name} 失败 (返回码: {process.returncode})。")
+            continue
+        yield (chunk_name, process.stdout, duration_sec)
+
 # --- Main Function (Replaces the old pydub-based split_audio) ---
 def split_audio(input_file, output_dir, max_chunk_length=MAX_CHUNK_LENGTH_SEC * 1000,
-                min_silence_len=int(MIN_SILENCE_LENGTH_SEC * 1000), silence_thresh=SILENCE_THRESH_DB):
+                min_silence_len=int(MIN_SILENCE_LENGTH_SEC * 1000), silence_thresh=SILENCE_THRESH_DB,
+                chunk_queue=None, in_memory_staging=False):
     """
     使用 ffmpeg 进行内存高效的音频切分。
     接口保持与旧函数兼容 (接受毫秒单位的长度参数)。
@@ -180,81 +372,69 @@ def split_audio(input_file, output_dir, max_chunk_length=MAX_CHUNK_LENGTH_SEC *
         max_chunk_length (int): 最大切片长度（毫秒）
         min_silence_len (int): 最小静音长度（毫秒）
         silence_thresh (int): 静音阈值（dB）
+        chunk_queue (Queue, optional): 若提供，每导出一个切片就立即将其路径放入队列，
+            供下游（如转录）边切分边消费。结束哨兵由调用方负责放入。
+        in_memory_staging (bool): 若为 True，切片先写入内存文件系统（Linux 上为
+            /dev/shm，否则为系统临时目录）再移动到 output_dir，减少导出阶段的磁盘写入
 
     Returns:
         list: 生成的音频片段文件路径列表
     """
     pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
 
+    # 内存暂存目录：ffmpeg 先写内存，成功后整体移动到目标目录
+    staging_dir = None
+    if in_memory_staging:
+        staging_root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        staging_dir = os.path.join(staging_root, f"trans_trans_{os.getpid()}")
+        pathlib.Path(staging_dir).mkdir(parents=True, exist_ok=True)
+        print(f"切片将先写入内存暂存目录: {staging_dir}")
+
     # --- 参数单位转换 ---
     max_chunk_length_sec = max_chunk_length / 1000.0
     min_silence_len_sec = min_silence_len / 1000.0
     silence_thresh_db = silence_thresh # dB单位不变
     # --------------------
 
-    print(f"加载音频信息: {input_file}")
-    total_length_sec = get_audio_duration_ffmpeg(input_file)
-    if total_length_sec is None:
-        print(f"错误：无法获取音频时长，无法继续切分 {input_file}")
+    # 计算切分区间
+    chunk_spans = _compute_chunk_spans(input_file, max_chunk_length_sec, min_silence_len_sec, silence_thresh_db)
+    if chunk_spans is None:
         return [] # 返回空列表表示失败
-    print(f"音频总长度: {total_length_sec:.2f} 秒 ({total_length_sec/60:.2f} 分钟)")
-
-    # 检测静音点 (使用ffmpeg)
-    silence_points_sec = detect_silence_with_ffmpeg(input_file, min_silence_len_sec, silence_thresh_db)
-
-    # 计算切分点 (使用ffmpeg检测到的静音点)
-    split_points_sec = find_optimal_split_points_sec(total_length_sec, silence_points_sec, max_chunk_length_sec)
-
-    # 执行切分 (使用ffmpeg)
-    chunk_files = []
-    start_time_sec = 0.0
-    for i, end_time_sec in enumerate(split_points_sec):
-        # 确保切片有有效长度
-        if end_time_sec <= start_time_sec + 0.01: # 增加一个小的阈值避免零长度或极短片段
-            print(f"  跳过无效切分点: {start_time_sec:.2f}s -> {end_time_sec:.2f}s")
-            continue
 
-        chunk_filename = os.path.join(output_dir, f"chunk_{i+1:03d}.mp3")
+    # 收集切分任务 (使用ffmpeg)
+    export_jobs = []
+    for i, (start_time_sec, end_time_sec) in enumerate(chunk_spans):
+        chunk_filename = os.path.join(staging_dir or output_dir, f"chunk_{i+1:03d}.mp3")
         duration_sec = end_time_sec - start_time_sec
 
-        print(f"导出片段 {i+1}/{len(split_points_sec)}: {start_time_sec:.2f}s - {end_time_sec:.2f}s ({duration_sec:.2f}s) -> {chunk_filename}")
-
-        # 使用 ffmpeg 提取片段
-        command_split = [
-            'ffmpeg',
-            '-i', input_file,
-            '-ss', str(start_time_sec), # 起始时间
-            '-to', str(end_time_sec),   # 结束时间 (使用 -to 比 -t 更精确)
-            '-c', 'copy',             # 直接复制流，速度快 (如果输入是MP3)
-            # '-acodec', 'libmp3lame', '-ab', '192k', # 如果需要重新编码，取消注释并调整参数
-            '-map_metadata', '-1',    # 去除元数据，避免潜在问题
-            '-loglevel', 'error',     # 只显示错误信息
-            '-y',                     # 覆盖已存在的文件
-            chunk_filename
-        ]
-        try:
-            # 运行ffmpeg命令
-            process = subprocess.run(command_split, check=True, capture_output=True, text=True, timeout=300) # Add timeout
-            chunk_files.append(chunk_filename)
-        except FileNotFoundError:
-             print("错误: ffmpeg 命令未找到。请确保 ffmpeg 已安装并添加到系统 PATH。")
-             return [] # 关键错误，停止处理
-        except subprocess.CalledProcessError as e:
-            print(f"  错误：ffmpeg 导出片段 {chunk_filename} 失败。")
-            print(f"  命令: {' '.join(e.cmd)}")
-            print(f"  返回码: {e.returncode}")
-            print(f"  错误输出: {e.stderr}")
-            # 可以选择继续处理其他片段或停止
-            # continue
-            # return [] # 如果一个失败就停止
-        except subprocess.TimeoutExpired:
-             print(f"错误：ffmpeg 导出片段 {chunk_filename} 超时。")
-             # 可以选择继续或停止
-        except Exception as e:
-             print(f"  导出片段 {chunk_filename} 时发生未知错误: {e}")
-             # 可以选择继续或停止
+        description = f"导出片段 {i+1}/{len(chunk_spans)}: {start_time_sec:.2f}s - {end_time_sec:.2f}s ({duration_sec:.2f}s) -> {chunk_filename}"
 
-        start_time_sec = end_time_sec # 更新下一个片段的起始时间
+        command_split = _build_extract_command(input_file, start_time_sec, duration_sec) + ['-y', chunk_filename]
+        export_jobs.append((description, command_split, chunk_filename))
+
+    # 并行执行导出，ffmpeg进程主要受磁盘/解码限制，少量并行即可占满多核
+    actual_workers = min(MAX_EXPORT_WORKERS, len(export_jobs)) or 1
+    print(f"使用 {actual_workers} 个并行ffmpeg进程导出 {len(export_jobs)} 个片段...")
+    chunk_files = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=actual_workers) as executor:
+            # executor.map 按提交顺序返回结果，保证 chunk_files 有序
+            for chunk_filename in executor.map(_export_chunk, export_jobs):
+                if chunk_filename:
+                    if staging_dir is not None:
+                        # 从内存暂存目录移动到目标目录（一次顺序写，替代ffmpeg的随机写）
+                        final_filename = os.path.join(output_dir, os.path.basename(chunk_filename))
+                        shutil.move(chunk_filename, final_filename)
+                        chunk_filename = final_filename
+                    chunk_files.append(chunk_filename)
+                    if chunk_queue is not None:
+                        chunk_queue.put(chunk_filename) # 切片就绪，立即交给下游消费
+    except FileNotFoundError:
+        print("错误: ffmpeg 命令未找到。请确保 ffmpeg 已安装并添加到系统 PATH。")
+        return [] # 关键错误，停止处理
+    finally:
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True) # 清理内存暂存目录
 
     if not chunk_files:
          print("错误：未能成功导出任何音频片段。")
@@ -275,6 +455,8 @@ def main():
                         help=f"最小静音长度，单位为毫秒 (默认: {int(MIN_SILENCE_LENGTH_SEC * 1000)}毫秒)")
     parser.add_argument("-t", "--silence-threshold", type=int, default=SILENCE_THRESH_DB,
                         help=f"静音阈值，单位为dB (默认: {SILENCE_THRESH_DB}dB)")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="切片先写入内存文件系统 (如 /dev/shm) 再移动到输出目录，减少磁盘写入")
 
     args = parser.parse_args()
 
@@ -283,7 +465,8 @@ def main():
     split_audio(args.input, args.output_dir,
                 max_chunk_length=args.max_length * 1000, # 秒转毫秒
                 min_silence_len=args.silence_length,     # 毫秒
-                silence_thresh=args.silence_threshold)   # dB
+                silence_thresh=args.silence_threshold,   # dB
+                in_memory_staging=args.in_memory)
     end_time_wall = time.time()
 
     print(f"处理完成，总耗时: {end_time_wall - start_time_wall:.2f} 秒")
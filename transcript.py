@@ -1,25 +1,36 @@
 import os
+import re
+import hashlib # 用于切片内容哈希（转录结果缓存）
+import json # 已完成转录清单（.manifest.json）的读写
 from google import genai
 import time
 import pathlib
 from google.genai import types
 import random # 导入 random 用于增加抖动
-import concurrent.futures # 导入并行处理库
-import threading # 导入线程库，用于线程安全操作
+import functools # lru_cache：系统指令按目标语言记忆化
+import asyncio # 异步并发：转录是纯网络等待，协程比线程池扩展性更好
 from google.genai import errors
 
+try:
+    import aiofiles # 可选：异步文件写入，写盘不阻塞事件循环
+except ImportError:
+    aiofiles = None
+
 # --- 配置 ---
 API_KEY = "YOUR_API_KEY_HERE" # 默认API密钥，建议通过参数传入而非硬编码
 AUDIO_DIR = "temp_audio_chunks_new_api" # 默认音频目录
 INTERMEDIATE_DIR = "intermediate_transcripts" # 默认中间转录文件目录
 MAX_RETRIES = 3 # 最大重试次数
 INITIAL_DELAY = 1 # 初始延迟秒数
+MAX_DELAY = 30 # 重试退避延迟上限（秒）
 DEFAULT_MODEL = "gemini-2.0-flash" # 更新默认模型为更快的版本
 DEFAULT_MAX_WORKERS = 4 # 新增：默认并行工作线程数
+INLINE_UPLOAD_LIMIT = 19_000_000 # 内联内容上限（字节）。Gemini请求上限约20MB，留出指令等开销的余量
 # -------------
 
 # --- 系统指令 ---
 # 将固定的指令放在这里，但把目标语言作为参数
+@functools.lru_cache(maxsize=8)
 def get_system_instruction(target_language="Simplified Chinese"):
     return f"""You are a transcription and translation service. Your task is to process the audio file provided in the content.
 First, provide the complete transcript in language used by audio.
@@ -47,156 +58,532 @@ During transcript, repeating words should be compressed into short notes.
 # 默认的系统指令使用简体中文
 SYSTEM_INSTRUCTION = get_system_instruction()
 
-def initialize_genai_client(api_key):
-    """初始化GenAI客户端"""
+# --- 批量转录支持 ---
+# 一次请求携带多个切片时，要求模型用该标记分隔各切片的输出，便于拆分回写
+_BATCH_MARKER_RE = re.compile(r'^\s*===\s*CHUNK\s+(\d+)\s*===\s*$', re.MULTILINE)
+
+def get_batch_system_instruction(system_instruction):
+    """在单切片系统指令的基础上，追加多切片批量处理的输出分隔要求"""
+    return system_instruction + """
+IMPORTANT: This request contains MULTIPLE audio chunks, in order, each preceded by a text marker like '--- CHUNK k ---'.
+Process EACH chunk independently and completely. Before the output for chunk k, emit a line containing exactly:
+=== CHUNK k ===
+then the full output format described above for that chunk alone. Do not merge content across chunks.
+"""
+
+def _split_batch_response(text, expected_count):
+    """按 '=== CHUNK k ===' 标记把批量响应拆分为各切片的文本。
+
+    Returns:
+        list 或 None: 按切片顺序排列的文本列表；标记缺失或编号不全时返回 None
+    """
+    parts = _BATCH_MARKER_RE.split(text)
+    # parts 形如 [前导文本, '1', 切片1文本, '2', 切片2文本, ...]
+    sections = {}
+    for i in range(1, len(parts) - 1, 2):
+        sections[int(parts[i])] = parts[i + 1].strip()
+    if set(sections) != set(range(1, expected_count + 1)):
+        return None
+    return [sections[k] for k in range(1, expected_count + 1)]
+
+def initialize_genai_client(api_key, max_workers=DEFAULT_MAX_WORKERS):
+    """初始化GenAI客户端
+
+    所有切片共用这一个客户端。默认的 httpx 连接池很小，并行上传/请求时
+    会不断新建TLS连接；这里按并发数调整连接池大小（每个在途文件最多有
+    上传/生成/删除等多个请求阶段，留4倍余量），让并行请求复用已有连接，
+    省掉每次约200ms的TLS握手。
+    """
     try:
-        return genai.Client(api_key=api_key)
+        try:
+            import httpx
+            pool_size = max_workers * 4
+            http_options = types.HttpOptions(
+                client_args={'limits': httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)},
+            )
+            return genai.Client(api_key=api_key, http_options=http_options)
+        except (ImportError, TypeError, ValueError) as e:
+            # httpx 不可用或 SDK 版本不支持 client_args 时退回默认配置
+            print(f"提示：无法配置HTTP连接池（{e}），使用默认配置。")
+            return genai.Client(api_key=api_key)
     except Exception as e:
         print(f"初始化 GenAI 客户端时出错: {e}")
         return None
 
-def process_audio_file(filepath, client, intermediate_dir, system_instruction=SYSTEM_INSTRUCTION, model_name=DEFAULT_MODEL):
-    """处理单个音频文件：上传、转录、删除，并保存中间转录文件，增加重试逻辑。"""
-    filename = os.path.basename(filepath)
-    transcript_filename = pathlib.Path(filename).stem + ".txt"
-    intermediate_filepath = os.path.join(intermediate_dir, transcript_filename)
+class CircuitOpenError(Exception):
+    """熔断器打开期间快速失败的标记异常"""
+
+class CircuitBreaker:
+    """跨任务共享的熔断器：API 全局故障时让所有并发任务快速失败，
+    而不是每个任务各自燃尽 MAX_RETRIES 次退避等待（N个任务 × 最多90秒）。
+
+    连续失败达到 failure_threshold 次后打开（open），timeout 秒内的新调用
+    直接抛 CircuitOpenError；超时后转半开（half_open）放行一次探测调用，
+    成功则闭合（closed），再失败则重新打开。所有任务共享同一事件循环，
+    状态更新之间没有 await 点，无需加锁。
+    """
+
+    def __init__(self, failure_threshold=5, timeout=30):
+        self.failure_threshold = failure_threshold
+        self.timeout = timeout
+        self.failures = 0 # 连续失败计数，成功后归零
+        self.state = 'closed'
+        self.opened_at = 0.0
+
+    def before_call(self):
+        """API调用前检查；熔断打开且未到探测时间时抛 CircuitOpenError"""
+        if self.state == 'open':
+            if time.time() - self.opened_at < self.timeout:
+                raise CircuitOpenError(
+                    f"熔断器已打开（连续 {self.failures} 次API失败），暂停调用 {self.timeout} 秒")
+            self.state = 'half_open' # 超时后放行一次探测调用
+
+    def record_success(self):
+        self.failures = 0
+        self.state = 'closed'
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = time.time()
+
+# 所有转录请求共享的熔断器（上传/删除等次要调用不计入）
+_GENERATE_BREAKER = CircuitBreaker()
+
+def _compute_backoff(attempt):
+    """计算第 attempt 次重试前的退避延迟（秒）。
+
+    采用带上限的"完全抖动"指数退避：在 0 到 min(MAX_DELAY, 2^attempt) 的整个
+    区间内均匀取随机值。相比固定指数 + 小幅抖动，能把大量并发请求同时失败后的
+    重试在时间上充分打散，避免重试风暴再次压垮API。
+    """
+    return random.uniform(0, min(MAX_DELAY, INITIAL_DELAY * (2 ** attempt)))
+
+_RETRYABLE_SERVER_CODES = {500, 502, 503, 504} # 暂时性的服务端错误状态码
 
-    print(f"开始处理: {filename}")
-    transcript = ""
-    uploaded_file = None
-    last_exception = None # 存储最后一次异常
+# 未类型化异常的兜底判断：一次编译好的正则搜索代替逐个子串比较。
+# 只对既非 genai 类型化错误也非 httpx 传输错误的异常使用
+_RETRYABLE_RE = re.compile(
+    r'disconnected|unavailable|bad gateway|internal server error|gateway timeout|50[234]',
+    re.IGNORECASE)
 
-    # --- 文件上传重试逻辑 ---
+def _is_retryable_error(e):
+    """判断一个API异常是否值得重试。
+
+    优先按类型化异常的状态码判断：服务端错误（500/502/503/504）和
+    限流（429）是暂时性的，可重试；其他客户端错误（认证失败、请求格式
+    错误等 4xx）重试只会白白消耗重试次数和等待时间。httpx 传输错误
+    （连接断开、超时等网络层问题）一律可重试。其余未类型化的异常退回
+    对错误消息做一次正则搜索。
+    """
+    if isinstance(e, errors.ServerError):
+        return e.code in _RETRYABLE_SERVER_CODES
+    if isinstance(e, errors.ClientError):
+        return e.code == 429
+    try:
+        import httpx
+        if isinstance(e, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    return _RETRYABLE_RE.search(str(e)) is not None
+
+def _extract_retry_after(e):
+    """从API错误中提取服务端建议的重试等待秒数，拿不到时返回 None。
+
+    限流/过载错误（429/503）通常带有 Retry-After 响应头，或在结构化错误
+    详情里给出 google.rpc.RetryInfo 的 retryDelay（形如 '7s'）。
+    """
+    # HTTP 响应头
+    headers = getattr(getattr(e, 'response', None), 'headers', None)
+    if headers:
+        value = headers.get('Retry-After') or headers.get('retry-after')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    # 结构化错误详情里的 RetryInfo
+    details = getattr(e, 'details', None)
+    if isinstance(details, dict):
+        details = details.get('error', {}).get('details', [])
+    if isinstance(details, list):
+        for item in details:
+            if isinstance(item, dict) and str(item.get('@type', '')).endswith('RetryInfo'):
+                delay = item.get('retryDelay', '')
+                if isinstance(delay, str) and delay.endswith('s'):
+                    try:
+                        return float(delay[:-1])
+                    except ValueError:
+                        pass
+    return None
+
+def _retry_delay_from_error(e, attempt):
+    """计算重试前的等待秒数：服务端给了明确的重试提示就照办（加少量抖动
+    避免同时被限流的请求一起涌回），否则退回带上限的完全抖动指数退避。
+    """
+    hint = _extract_retry_after(e)
+    if hint is not None:
+        return hint + random.uniform(0, 0.5)
+    return _compute_backoff(attempt)
+
+async def _retry_api_call(call, description, log=print, breaker=None):
+    """统一的API调用重试循环：上传、内容生成、删除共用这一份重试策略
+    （次数上限、可重试分类、Retry-After/退避等待、可选熔断），避免多份
+    手写循环各自漂移。
+
+    Args:
+        call: 无参协程工厂，每次尝试调用一次
+        description: 日志中的动作描述（如 '上传 chunk_001.mp3'）
+        log: 日志函数（process_audio_file 内传入行缓冲的 log）
+        breaker: 可选的 CircuitBreaker，调用前检查、按成败记录
+
+    Returns:
+        tuple: (结果, None) 或失败时 (None, 最后一次异常)
+    """
+    last_exception = None
     for attempt in range(MAX_RETRIES):
         try:
-            print(f"  上传中 (尝试 {attempt + 1}/{MAX_RETRIES}): {filename}")
-            uploaded_file = client.files.upload(file=filepath)
-            print(f"  已上传: {filename} -> {uploaded_file.name}")
-            last_exception = None # 成功后清除异常
-            break # 上传成功，跳出重试循环
+            if breaker is not None:
+                breaker.before_call()
+            log(f"  {description} (尝试 {attempt + 1}/{MAX_RETRIES})")
+            result = await call()
+            if breaker is not None:
+                breaker.record_success()
+            return result, None
+        except CircuitOpenError as e:
+            last_exception = e
+            log(f"  {e}，快速失败: {description}")
+            break # 不消耗重试预算，留给断点续传下次处理
         except Exception as e:
+            if breaker is not None:
+                breaker.record_failure()
             last_exception = e
-            print(f"  上传失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {e}")
+            log(f"  {description}失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {e}")
+            # 按异常类型和状态码判断是否可重试
+            if not _is_retryable_error(e):
+                log(f"  遇到非暂时性错误，停止重试: {description}")
+                break
             if attempt < MAX_RETRIES - 1:
-                # 指数退避 + 抖动
-                delay = (INITIAL_DELAY * (2 ** attempt)) + random.uniform(0, 1)
-                print(f"  将在 {delay:.2f} 秒后重试上传...")
-                time.sleep(delay)
+                delay = _retry_delay_from_error(e, attempt)
+                log(f"  将在 {delay:.2f} 秒后重试...")
+                await asyncio.sleep(delay)
             else:
-                print(f"  上传达到最大重试次数，放弃文件: {filename}")
-                # 记录错误到中间文件
-                try:
-                    with open(intermediate_filepath, "w", encoding="utf-8") as f_inter:
-                        f_inter.write(f"Error uploading {filename} after {MAX_RETRIES} attempts: {last_exception}\n")
-                    print(f"  已保存上传错误信息到中间文件: {intermediate_filepath}")
-                except IOError as e_write_err:
-                     print(f"  错误：无法写入上传错误信息的中间文件 {intermediate_filepath}: {e_write_err}")
-                return "" # 上传失败，返回空
-
-    # 如果上传成功 (uploaded_file is not None)
-    if uploaded_file:
-        # --- 内容生成重试逻辑 ---
-        for attempt in range(MAX_RETRIES):
+                log(f"  {description}达到最大重试次数，放弃。")
+    return None, last_exception
+
+async def _write_intermediate(intermediate_filepath, content):
+    """写入中间转录文件（成功转录、错误标记、空结果警告共用此出口）。
+
+    装了 aiofiles 时用异步写，慢速存储（网络挂载等）上的写盘不会卡住
+    事件循环里的其他转录任务；否则退回普通同步写。
+
+    Returns:
+        bool: 写入是否成功（失败时已打印错误）
+    """
+    try:
+        if aiofiles is not None:
+            async with aiofiles.open(intermediate_filepath, 'w', encoding='utf-8') as f_inter:
+                await f_inter.write(content)
+        else:
+            with open(intermediate_filepath, 'w', encoding='utf-8') as f_inter:
+                f_inter.write(content)
+        return True
+    except IOError as e_write:
+        print(f"  错误：无法写入中间文件 {intermediate_filepath}: {e_write}")
+        return False
+
+def _chunk_content_hash(filepath):
+    """计算切片文件内容的 blake2b 摘要（16字节十六进制），用于内容寻址的转录缓存"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+async def process_audio_file(filepath, client, intermediate_dir, system_instruction=SYSTEM_INSTRUCTION, model_name=DEFAULT_MODEL, filename=None, intermediate_filepath=None, cleanup_uploads=False):
+    """处理单个音频文件并保存中间转录文件，增加重试逻辑。
+
+    filename / intermediate_filepath 可由调用方传入已算好的值
+    （run_transcription 的包装协程本来就要算一遍），避免重复解析路径。
+
+    协程实现：所有API调用走 client.aio 的异步接口，重试等待用 asyncio.sleep，
+    等待网络期间不占用线程。内联上限以内的文件（绝大多数切片）直接把字节作为内联内容发送，
+    省去 Files API 的上传和删除两次网络往返；超过上限的文件才走上传路径。
+    转录成功的结果同时按切片内容哈希存入 intermediate_dir/by_hash/，
+    内容相同的切片（如重新切分后未变的部分）直接复用，不再请求API。
+    """
+    # 本文件的日志行先缓冲，结束时一次性整块输出，避免并发任务的日志互相穿插
+    log_lines = []
+    log = log_lines.append
+    try:
+        if filename is None:
+            filename = os.path.basename(filepath)
+        if intermediate_filepath is None:
+            # 用字符串操作取主文件名，避免为每个文件构造 pathlib.Path 对象
+            intermediate_filepath = os.path.join(intermediate_dir, filename.rsplit('.', 1)[0] + ".txt")
+
+        log(f"开始处理: {filename}")
+        transcript = ""
+        uploaded_file = None
+        audio_content = None # 发送给模型的音频内容：内联 Part 或已上传的文件句柄
+        last_exception = None # 存储最后一次异常
+
+        # --- 内容哈希缓存：字节完全相同的切片直接复用既有转录，跳过整个API往返 ---
+        content_hash = None
+        try:
+            content_hash = _chunk_content_hash(filepath)
+            cached_path = os.path.join(intermediate_dir, "by_hash", content_hash + ".txt")
+            if os.path.isfile(cached_path) and os.path.getsize(cached_path) > 0:
+                with open(cached_path, 'r', encoding='utf-8') as f_cache:
+                    cached_transcript = f_cache.read()
+                with open(intermediate_filepath, 'w', encoding='utf-8') as f_inter:
+                    f_inter.write(cached_transcript)
+                log(f"  命中内容哈希缓存，复用既有转录: {filename} ({content_hash})")
+                return cached_transcript
+        except OSError as e:
+            log(f"  提示：转录缓存不可用 ({e})，继续正常转录: {filename}")
+
+        # --- 准备音频内容：优先内联，超限才上传 ---
+        try:
+            file_size = os.path.getsize(filepath)
+        except OSError as e:
+            log(f"  错误：无法读取文件大小 {filepath}: {e}")
+            file_size = None
+
+        if file_size is not None and file_size <= INLINE_UPLOAD_LIMIT:
+            try:
+                with open(filepath, 'rb') as f_audio:
+                    audio_content = types.Part.from_bytes(data=f_audio.read(), mime_type='audio/mpeg')
+                log(f"  以内联内容发送: {filename} ({file_size} 字节)")
+            except OSError as e:
+                last_exception = e
+                log(f"  错误：读取文件失败 {filepath}: {e}")
+        elif file_size is not None:
+            # --- 文件上传重试逻辑（仅超过内联上限的大文件） ---
+            # 传入已打开的二进制文件对象而不是路径，让SDK的HTTP层流式发送请求体，
+            # 内存占用与文件大小无关（传路径时SDK可能先把整个文件读进内存）
+            log(f"  文件超过内联上限 ({file_size} 字节)，使用 Files API 流式上传: {filename}")
             try:
-                print(f"  请求转录 (尝试 {attempt + 1}/{MAX_RETRIES}, 模型: {model_name}): {filename}")
-                response = client.models.generate_content(
+                with open(filepath, 'rb') as f_upload:
+                    async def _do_upload():
+                        f_upload.seek(0) # 重试时从文件头重新开始
+                        return await client.aio.files.upload(
+                            file=f_upload,
+                            config={'mime_type': 'audio/mpeg', 'display_name': filename},
+                        )
+                    uploaded_file, last_exception = await _retry_api_call(
+                        _do_upload, f"上传 {filename}", log=log)
+                    if uploaded_file:
+                        log(f"  已上传: {filename} -> {uploaded_file.name}")
+                        audio_content = uploaded_file
+            except OSError as e:
+                last_exception = e
+                log(f"  错误：打开文件失败 {filepath}: {e}")
+
+        if audio_content is None:
+            # 既没能内联也没能上传，记录错误到中间文件
+            if await _write_intermediate(intermediate_filepath, f"Error preparing {filename} for transcription: {last_exception}\n"):
+                log(f"  已保存错误信息到中间文件: {intermediate_filepath}")
+            return "" # 准备内容失败，返回空
+
+        if audio_content is not None:
+            # --- 内容生成重试逻辑 ---
+            # 配置对象在重试之间不变，只构造一次（Pydantic模型构造有验证开销）
+            generate_config = types.GenerateContentConfig(system_instruction=system_instruction)
+
+            async def _do_generate():
+                return await client.aio.models.generate_content(
                     model=model_name, # 使用传入的模型名称
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction,
-                    ),
-                    contents=[uploaded_file]
+                    config=generate_config,
+                    contents=[audio_content]
                 )
+            response, last_exception = await _retry_api_call(
+                _do_generate, f"请求转录 {filename} (模型: {model_name})",
+                log=log, breaker=_GENERATE_BREAKER)
+            if response is not None:
                 transcript = response.text
-                last_exception = None # 成功后清除异常
-                print(f"  获取到转录: {filename}")
-                break # 转录成功，跳出重试循环
-            except Exception as e:
-                last_exception = e
-                print(f"  转录失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {e}")
-                # 修改这里，加入对 502 错误的判断
-                error_str = str(e).lower() # 转小写方便判断
-                # 检查是否是适合重试的错误类型或消息
-                if "disconnected" in error_str or \
-                   "unavailable" in error_str or \
-                   "502 bad gateway" in error_str or \
-                   "internal server error" in error_str or \
-                   "500 internal server error" in error_str or \
-                   "503 service unavailable" in error_str or \
-                   "504 gateway timeout" in error_str or \
-                   True: # Placeholder for other retryable errors
-                    if attempt < MAX_RETRIES - 1:
-                        delay = (INITIAL_DELAY * (2 ** attempt)) + random.uniform(0, 1)
-                        print(f"  检测到可重试错误，将在 {delay:.2f} 秒后重试转录...")
-                        time.sleep(delay)
-                    else:
-                        print(f"  转录达到最大重试次数，放弃文件: {filename}")
-                else:
-                    # 对于可能不适合重试的错误（如API密钥错误、请求格式错误 4xx），直接跳出重试
-                    print(f"  遇到非暂时性错误或未知错误，停止重试: {filename}")
-                    break # 跳出重试循环，后续会记录错误
-
-        # --- 保存转录或错误信息 ---
+                log(f"  获取到转录: {filename}")
+
+            # --- 保存转录或错误信息 ---
+            if transcript:
+                # 即使写入失败，也会继续尝试删除上传的文件
+                if await _write_intermediate(intermediate_filepath, transcript):
+                    log(f"  已保存中间转录文件: {intermediate_filepath}")
+                # 同时写入内容哈希缓存，供内容相同的切片复用
+                if content_hash:
+                    try:
+                        by_hash_dir = os.path.join(intermediate_dir, "by_hash")
+                        pathlib.Path(by_hash_dir).mkdir(parents=True, exist_ok=True)
+                        with open(os.path.join(by_hash_dir, content_hash + ".txt"), "w", encoding="utf-8") as f_hash:
+                            f_hash.write(transcript)
+                    except OSError as e_hash:
+                        log(f"  提示：写入转录缓存失败 ({e_hash})，不影响结果。")
+            elif last_exception: # 如果转录为空且有异常发生（无论是重试耗尽还是非暂时错误）
+                log(f"  警告：文件 {filename} 未能成功转录。最后错误: {last_exception}")
+                if await _write_intermediate(intermediate_filepath, f"Error processing {filename} after retries: {last_exception}\n"):
+                    log(f"  已保存转录错误信息到中间文件: {intermediate_filepath}")
+                transcript = "" # 确保返回空字符串
+            else: # 转录为空但没有异常（例如模型返回空内容）
+                 log(f"  警告：文件 {filename} 返回了空转录文本，但没有检测到API错误。")
+                 # 仍然写入一个包含警告的文件
+                 if await _write_intermediate(intermediate_filepath, f"Warning: Empty transcript returned for {filename} without API error.\n"):
+                     log(f"  已保存空转录警告到中间文件: {intermediate_filepath}")
+                 transcript = ""
+
+            # --- 文件删除重试逻辑（内联发送没有服务端文件，无需删除） ---
+            # 服务端会在48小时后自动清理上传的文件，删除只是礼貌性的；
+            # 默认跳过，省下每个大文件一次API往返（失败时还有整个重试退避预算）
+            if uploaded_file and not cleanup_uploads:
+                log(f"  跳过删除 {uploaded_file.name}（服务端将在48小时后自动过期清理）")
+            elif uploaded_file:
+                async def _do_delete():
+                    await client.aio.files.delete(name=uploaded_file.name)
+                    return True
+                deleted, delete_exception = await _retry_api_call(
+                    _do_delete, f"删除已上传文件 {uploaded_file.name}", log=log)
+                if deleted:
+                    log(f"  已删除: {uploaded_file.name}")
+                elif delete_exception:
+                    # 记录删除失败，但不影响函数返回值
+                    log(f"  最终未能删除文件 {uploaded_file.name}: {delete_exception}")
+
+            return transcript
+    finally:
+        if log_lines:
+            print('\n'.join(log_lines), flush=True)
+
+async def process_audio_batch(filepaths, client, intermediate_dir, system_instruction=SYSTEM_INSTRUCTION, model_name=DEFAULT_MODEL):
+    """批量处理多个音频切片：把多个切片作为内联内容放进同一次 generate_content 请求，
+    按 '=== CHUNK k ===' 标记拆分响应并分别写入各自的中间转录文件。
+
+    每个切片的固定开销（请求排队、模型启动）被批量摊薄；任何切片无法内联
+    或响应无法按标记拆分时，整批退回逐文件处理，保证不丢切片。
+
+    Args:
+        filepaths: 同一批次的音频文件路径列表（按顺序）
+
+    Returns:
+        dict: filepath -> 转录文本（失败的切片为空字符串）
+    """
+    if len(filepaths) == 1:
+        return {filepaths[0]: await process_audio_file(filepaths[0], client, intermediate_dir, system_instruction, model_name)}
+
+    async def _fallback():
+        print(f"  批量处理退回逐文件模式 ({len(filepaths)} 个切片)...")
+        return {fp: await process_audio_file(fp, client, intermediate_dir, system_instruction, model_name)
+                for fp in filepaths}
+
+    names = [os.path.basename(fp) for fp in filepaths]
+    print(f"开始批量处理 {len(filepaths)} 个切片: {', '.join(names)}")
+
+    # 构造交替的 标记/音频 内容列表
+    contents = []
+    for k, filepath in enumerate(filepaths, start=1):
+        try:
+            if os.path.getsize(filepath) > INLINE_UPLOAD_LIMIT:
+                print(f"  切片 {names[k-1]} 超过内联上限，无法批量发送。")
+                return await _fallback()
+            with open(filepath, 'rb') as f_audio:
+                data = f_audio.read()
+        except OSError as e:
+            print(f"  错误：读取切片 {names[k-1]} 失败: {e}")
+            return await _fallback()
+        contents.append(f"--- CHUNK {k} ---")
+        contents.append(types.Part.from_bytes(data=data, mime_type='audio/mpeg'))
+
+    # --- 批量请求重试逻辑（与单文件路径相同的退避策略） ---
+    batch_config = types.GenerateContentConfig(
+        system_instruction=get_batch_system_instruction(system_instruction),
+    )
+    async def _do_generate_batch():
+        return await client.aio.models.generate_content(
+            model=model_name,
+            config=batch_config,
+            contents=contents
+        )
+    response, _batch_exception = await _retry_api_call(
+        _do_generate_batch,
+        f"请求批量转录 ({len(filepaths)} 切片, 模型: {model_name})",
+        breaker=_GENERATE_BREAKER)
+    response_text = (response.text or "") if response is not None else ""
+
+    sections = _split_batch_response(response_text, len(filepaths)) if response_text else None
+    if sections is None:
+        # 请求失败或响应缺少分块标记：退回逐文件处理
+        print("  批量响应无法按切片拆分。")
+        return await _fallback()
+
+    # 拆分成功：逐个写入中间转录文件
+    results = {}
+    for filepath, filename, transcript in zip(filepaths, names, sections):
+        intermediate_filepath = os.path.join(intermediate_dir, filename.rsplit('.', 1)[0] + ".txt")
+        content = transcript or f"Warning: Empty transcript returned for {filename} in batch without API error.\n"
+        if await _write_intermediate(intermediate_filepath, content):
+            print(f"  已保存中间转录文件: {intermediate_filepath}")
+        results[filepath] = transcript
+    return results
+
+async def transcribe_chunk_bytes(chunk_name, data, client, intermediate_dir, system_instruction=SYSTEM_INSTRUCTION, model_name=DEFAULT_MODEL):
+    """转录内存中的音频切片字节：直接作为内联内容发送给模型，不经过 Files API。
+
+    配合 split_audio.iter_chunk_bytes 使用，可实现完全不落盘的切分+转录流程
+    （切片字节经 ffmpeg 管道直接进入请求体）。中间转录文件仍照常写入
+    intermediate_dir，保持与 process_audio_file 相同的输出约定。
+
+    Args:
+        chunk_name: 切片名（如 chunk_001.mp3，用于命名中间转录文件）
+        data: 切片的MP3字节
+        client: GenAI客户端
+        intermediate_dir: 中间转录文件保存目录
+
+    Returns:
+        str: 转录文本，失败时返回空字符串
+    """
+    # 本文件的日志行先缓冲，结束时一次性整块输出，避免并发任务的日志互相穿插
+    log_lines = []
+    log = log_lines.append
+    try:
+        transcript_filename = chunk_name.rsplit('.', 1)[0] + ".txt"
+        intermediate_filepath = os.path.join(intermediate_dir, transcript_filename)
+
+        log(f"开始处理 (内存切片): {chunk_name} ({len(data)} 字节)")
+        transcript = ""
+        last_exception = None
+        audio_part = types.Part.from_bytes(data=data, mime_type='audio/mpeg')
+        generate_config = types.GenerateContentConfig(system_instruction=system_instruction)
+
+        async def _do_generate():
+            return await client.aio.models.generate_content(
+                model=model_name,
+                config=generate_config,
+                contents=[audio_part]
+            )
+        response, last_exception = await _retry_api_call(
+            _do_generate, f"请求转录 {chunk_name} (模型: {model_name})",
+            log=log, breaker=_GENERATE_BREAKER)
+        if response is not None:
+            transcript = response.text
+            log(f"  获取到转录: {chunk_name}")
+
         if transcript:
-            try:
-                with open(intermediate_filepath, "w", encoding="utf-8") as f_inter:
-                    f_inter.write(transcript)
-                print(f"  已保存中间转录文件: {intermediate_filepath}")
-            except IOError as e_write:
-                print(f"  错误：无法写入中间文件 {intermediate_filepath}: {e_write}")
-                # 即使写入失败，也尝试删除上传的文件
-        elif last_exception: # 如果转录为空且有异常发生（无论是重试耗尽还是非暂时错误）
-            print(f"  警告：文件 {filename} 未能成功转录。最后错误: {last_exception}")
-            try:
-                with open(intermediate_filepath, "w", encoding="utf-8") as f_inter:
-                    f_inter.write(f"Error processing {filename} after retries: {last_exception}\n")
-                print(f"  已保存转录错误信息到中间文件: {intermediate_filepath}")
-            except IOError as e_write_err:
-                 print(f"  错误：无法写入转录错误信息的中间文件 {intermediate_filepath}: {e_write_err}")
-            transcript = "" # 确保返回空字符串
-        else: # 转录为空但没有异常（例如模型返回空内容）
-             print(f"  警告：文件 {filename} 返回了空转录文本，但没有检测到API错误。")
-             try:
-                 # 仍然可以写入一个空文件或包含警告的文件
-                 with open(intermediate_filepath, "w", encoding="utf-8") as f_inter:
-                     f_inter.write(f"Warning: Empty transcript returned for {filename} without API error.\n")
-                 print(f"  已保存空转录警告到中间文件: {intermediate_filepath}")
-             except IOError as e_write_err:
-                 print(f"  错误：无法写入空转录警告的中间文件 {intermediate_filepath}: {e_write_err}")
-             transcript = ""
-
-        # --- 文件删除重试逻辑 ---
-        last_delete_exception = None
-        for attempt in range(MAX_RETRIES):
-            try:
-                print(f"  删除已上传文件 (尝试 {attempt + 1}/{MAX_RETRIES}): {uploaded_file.name}")
-                client.files.delete(name=uploaded_file.name)
-                print(f"  已删除: {uploaded_file.name}")
-                last_delete_exception = None
-                break # 删除成功
-            except Exception as delete_err:
-                last_delete_exception = delete_err
-                print(f"  删除文件失败 (尝试 {attempt + 1}/{MAX_RETRIES}): {delete_err}")
-                if attempt < MAX_RETRIES - 1:
-                    delay = (INITIAL_DELAY * (2 ** attempt)) + random.uniform(0, 1)
-                    print(f"  将在 {delay:.2f} 秒后重试删除...")
-                    time.sleep(delay)
-                else:
-                    print(f"  删除文件 {uploaded_file.name} 达到最大重试次数，放弃删除。")
-
-        if last_delete_exception:
-             # 记录删除失败，但不影响函数返回值
-             print(f"  最终未能删除文件 {uploaded_file.name}: {last_delete_exception}")
-
-        return transcript
+            content = transcript
+        elif last_exception:
+            content = f"Error processing {chunk_name} after retries: {last_exception}\n"
+        else:
+            content = f"Warning: Empty transcript returned for {chunk_name} without API error.\n"
+        if await _write_intermediate(intermediate_filepath, content):
+            log(f"  已保存中间转录文件: {intermediate_filepath}")
 
-    else:
-        # 如果 uploaded_file 为 None (即上传从未成功)
-        print(f"文件 {filename} 未能上传，跳过后续处理。")
-        return "" # 确保返回空字符串
+        return transcript if transcript else ""
+    finally:
+        if log_lines:
+            print('\n'.join(log_lines), flush=True)
 
-def run_transcription(api_key, audio_dir, intermediate_dir, system_instruction=SYSTEM_INSTRUCTION, model_name=DEFAULT_MODEL, progress_queue=None, max_workers=DEFAULT_MAX_WORKERS, skip_existing=True):
+def run_transcription(api_key, audio_dir, intermediate_dir, system_instruction=SYSTEM_INSTRUCTION, model_name=DEFAULT_MODEL, progress_queue=None, max_workers=DEFAULT_MAX_WORKERS, skip_existing=True, chunk_queue=None, batch_size=1, cleanup_uploads=False):
     """处理一个目录中的所有音频文件，生成转录文本，支持并行处理
-    
+
     Args:
         api_key: Google AI API密钥
         audio_dir: 音频文件目录
@@ -204,14 +591,20 @@ def run_transcription(api_key, audio_dir, intermediate_dir, system_instruction=S
         system_instruction: 系统指令
         model_name: 使用的模型名称
         progress_queue: 进度队列
-        max_workers: 最大并行处理线程数
+        max_workers: 最大并发请求数（asyncio 信号量上限）
         skip_existing: 是否跳过已存在的转录文件（断点续传）
-    
+        chunk_queue: 可选的音频文件队列。若提供则不扫描 audio_dir，而是持续消费
+            队列中的文件路径（None 为结束哨兵），实现切分与转录的流水线重叠
+        batch_size: 每次 generate_content 请求携带的切片数（默认1，即逐文件请求；
+            >1 时按组批量请求，摊薄每次请求的固定开销。流式模式下忽略此参数）
+        cleanup_uploads: 是否在转录后立即删除通过 Files API 上传的文件
+            （默认否，依赖服务端48小时自动过期，省一次API往返）
+
     Returns:
         bool: 操作是否成功
     """
-    # 初始化客户端
-    client = initialize_genai_client(api_key)
+    # 初始化客户端（连接池按并发数定大小）
+    client = initialize_genai_client(api_key, max_workers=max_workers)
     if not client:
         error_msg = "无法初始化GenAI客户端，请检查API密钥"
         if progress_queue:
@@ -226,39 +619,87 @@ def run_transcription(api_key, audio_dir, intermediate_dir, system_instruction=S
         progress_queue.put(status_msg)
     print(status_msg)
 
-    # 获取并排序文件路径
+    # --- 已完成清单：重启时 O(1) 判断文件是否已转录 ---
+    # 不再为每个文件打开读取中间 .txt 检查内容；成功转录时把文件的
+    # size/mtime 记入 intermediate_dir/.manifest.json，下次启动只需一次 stat 比对
+    manifest_path = os.path.join(intermediate_dir, ".manifest.json")
     try:
-        audio_files = sorted([
-            os.path.join(audio_dir, f)
-            for f in os.listdir(audio_dir)
-            if f.endswith(".mp3")
-        ])
-    except FileNotFoundError:
-        error_msg = f"错误：找不到目录 {audio_dir}"
-        if progress_queue:
-            progress_queue.put(error_msg)
-        print(error_msg)
-        return False
-    except Exception as e:
-        error_msg = f"读取目录 {audio_dir} 时出错: {e}"
-        if progress_queue:
-            progress_queue.put(error_msg)
-        print(error_msg)
-        return False
+        with open(manifest_path, 'r', encoding='utf-8') as f_manifest:
+            done_manifest = json.load(f_manifest)
+    except (OSError, ValueError):
+        done_manifest = {}
+    manifest_dirty = False
 
-    if not audio_files:
-        error_msg = f"在目录 {audio_dir} 中未找到 .mp3 文件。"
-        if progress_queue:
-            progress_queue.put(error_msg)
-        print(error_msg)
-        return False
+    def record_done(transcript_filename, intermediate_filepath):
+        nonlocal manifest_dirty
+        try:
+            st = os.stat(intermediate_filepath)
+            done_manifest[transcript_filename] = {'size': st.st_size, 'mtime': st.st_mtime}
+            manifest_dirty = True
+        except OSError:
+            pass
+
+    def save_manifest():
+        nonlocal manifest_dirty
+        if not manifest_dirty:
+            return
+        try:
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f_manifest:
+                json.dump(done_manifest, f_manifest)
+            os.replace(tmp_path, manifest_path) # 原子替换，避免中断留下半个清单
+            manifest_dirty = False
+        except OSError as e:
+            print(f"提示：写入完成清单失败 ({e})，下次启动将退回逐文件检查。")
 
-    # 创建线程安全的计数器和锁
+    # 流式模式：文件路径由上游（切分）通过队列实时提供，总数未知
+    streaming = chunk_queue is not None
+
+    # 获取并排序文件路径
+    if streaming:
+        audio_files = [] # 随消费逐步填充，用于最终汇总
+        total_display = "?" # 进度显示用的总数（流式模式下未知）
+    else:
+        try:
+            # os.scandir 单次遍历同时取得完整路径和大小——目录项的 stat 结果
+            # 多数平台已随遍历带回，排序键不再逐文件调用 os.path.getsize。
+            # 按文件大小降序提交（LPT调度）：最长的切片最先开始，短切片填满
+            # 收尾阶段的空闲并发位，缩短整批任务的总完成时间；
+            # 同大小按文件名排序保证确定性。中间文件按切片名落盘，
+            # 后续合并仍按文件名顺序，不受提交顺序影响
+            with os.scandir(audio_dir) as dir_iter:
+                sized_entries = [(entry.path, entry.stat().st_size)
+                                 for entry in dir_iter if entry.name.endswith(".mp3")]
+            sized_entries.sort(key=lambda t: (-t[1], t[0]))
+            audio_files = [path for path, _ in sized_entries]
+        except FileNotFoundError:
+            error_msg = f"错误：找不到目录 {audio_dir}"
+            if progress_queue:
+                progress_queue.put(error_msg)
+            print(error_msg)
+            return False
+        except Exception as e:
+            error_msg = f"读取目录 {audio_dir} 时出错: {e}"
+            if progress_queue:
+                progress_queue.put(error_msg)
+            print(error_msg)
+            return False
+
+        if not audio_files:
+            error_msg = f"在目录 {audio_dir} 中未找到 .mp3 文件。"
+            if progress_queue:
+                progress_queue.put(error_msg)
+            print(error_msg)
+            return False
+
+        total_display = len(audio_files)
+
+    # 计数器。所有协程跑在同一事件循环里，计数更新之间没有 await，
+    # 天然原子，不再需要锁
     processed_count = 0
     success_count = 0
     skipped_count = 0  # 新增：跳过的文件计数
-    count_lock = threading.Lock()
-    
+
     # 用于安全更新进度的函数
     def update_progress(message):
         if progress_queue:
@@ -284,105 +725,212 @@ def run_transcription(api_key, audio_dir, intermediate_dir, system_instruction=S
                 return has_transcript and has_translation
         except Exception:
             return False
-    
-    # 包装处理函数，管理计数和进度更新
-    def process_file_with_progress(filepath):
+
+    # 本次运行内容检查结果的记忆化：同一文件无论被预扫描、单文件路径还是
+    # 批量路径问到多少次，open+read 的内容检查最多只做一次
+    validity_cache = {}
+
+    def is_transcript_done(transcript_filename, intermediate_filepath):
+        """O(1) 判断转录是否已完成：先查清单并核对 size/mtime，
+        清单没有记录时才退回读取文件内容检查（结果记忆化并补进清单）。
+        """
+        entry = done_manifest.get(transcript_filename)
+        if entry:
+            try:
+                st = os.stat(intermediate_filepath)
+                if st.st_size == entry.get('size') and st.st_mtime == entry.get('mtime'):
+                    return True
+            except OSError:
+                pass # 文件被删除或无法访问，按未完成处理
+        if intermediate_filepath not in validity_cache:
+            validity_cache[intermediate_filepath] = is_valid_transcript_file(intermediate_filepath)
+        if validity_cache[intermediate_filepath]:
+            record_done(transcript_filename, intermediate_filepath)
+            return True
+        return False
+
+    # 包装处理协程，管理计数和进度更新
+    async def process_file_with_progress(filepath):
         nonlocal processed_count, success_count, skipped_count
         filename = os.path.basename(filepath)
-        transcript_filename = pathlib.Path(filename).stem + ".txt"
+        transcript_filename = filename.rsplit('.', 1)[0] + ".txt"
         intermediate_filepath = os.path.join(intermediate_dir, transcript_filename)
-        
-        # 新增：检查是否存在有效的转录文件，如果存在且设置了跳过，则跳过处理
-        if skip_existing and is_valid_transcript_file(intermediate_filepath):
-            with count_lock:
-                processed_count += 1
-                skipped_count += 1
-                success_count += 1
-                current_count = processed_count
-                
-            update_progress(f"({current_count}/{len(audio_files)}) 跳过已存在的转录: {filename}")
+
+        # 新增：检查是否存在有效的转录文件，如果存在且设置了跳过，则跳过处理。
+        # 预扫描集合里没有的主名必然未完成，无需任何文件系统检查
+        if skip_existing and \
+                (existing_stems is None or filename.rsplit('.', 1)[0] in existing_stems) and \
+                is_transcript_done(transcript_filename, intermediate_filepath):
+            processed_count += 1
+            skipped_count += 1
+            success_count += 1
+            current_count = processed_count
+
+            update_progress(f"({current_count}/{total_display}) 跳过已存在的转录: {filename}")
             return "SKIPPED"
-        
+
         # 处理文件
         try:
-            result = process_audio_file(filepath, client, intermediate_dir, system_instruction, model_name)
-            
+            result = await process_audio_file(filepath, client, intermediate_dir, system_instruction, model_name,
+                                              filename=filename, intermediate_filepath=intermediate_filepath,
+                                              cleanup_uploads=cleanup_uploads)
+
             # 更新计数
-            with count_lock:
-                processed_count += 1
-                current_count = processed_count  # 复制当前值以在锁外使用
-                
-                # 检查是否有有效的转录结果
-                if os.path.exists(intermediate_filepath) and os.path.getsize(intermediate_filepath) > 0:
-                    # 检查文件内容是否包含错误标记
-                    try:
-                        with open(intermediate_filepath, 'r', encoding='utf-8') as f_check:
-                            first_line = f_check.readline().lower()
-                            if "error" not in first_line and "warning" not in first_line:
-                                success_count += 1
-                                status_msg = f"({current_count}/{len(audio_files)}) 成功处理: {filename}"
-                            else:
-                                status_msg = f"({current_count}/{len(audio_files)}) 处理完成但有警告/错误: {filename}"
-                    except Exception:
-                        status_msg = f"({current_count}/{len(audio_files)}) 处理完成但无法验证结果: {filename}"
-                else:
-                    status_msg = f"({current_count}/{len(audio_files)}) 处理完成但未生成有效转录: {filename}"
-            
-            # 更新进度（在锁外执行，避免阻塞其他线程）
+            processed_count += 1
+            current_count = processed_count
+
+            # 检查是否有有效的转录结果
+            if os.path.exists(intermediate_filepath) and os.path.getsize(intermediate_filepath) > 0:
+                # 检查文件内容是否包含错误标记
+                try:
+                    with open(intermediate_filepath, 'r', encoding='utf-8') as f_check:
+                        first_line = f_check.readline().lower()
+                        if "error" not in first_line and "warning" not in first_line:
+                            success_count += 1
+                            record_done(transcript_filename, intermediate_filepath)
+                            status_msg = f"({current_count}/{total_display}) 成功处理: {filename}"
+                        else:
+                            status_msg = f"({current_count}/{total_display}) 处理完成但有警告/错误: {filename}"
+                except Exception:
+                    status_msg = f"({current_count}/{total_display}) 处理完成但无法验证结果: {filename}"
+            else:
+                status_msg = f"({current_count}/{total_display}) 处理完成但未生成有效转录: {filename}"
+
             update_progress(status_msg)
             return result
-            
+
         except Exception as e:
             # 处理异常
-            with count_lock:
+            processed_count += 1
+            current_count = processed_count
+            error_msg = f"({current_count}/{total_display}) 处理 {filename} 时发生错误: {e}"
+            update_progress(error_msg)
+            return ""
+
+    # 包装批量处理协程，管理计数和进度更新
+    async def process_batch_with_progress(batch):
+        nonlocal processed_count, success_count, skipped_count
+        # 先按断点续传过滤掉已完成的文件
+        pending = []
+        for filepath in batch:
+            filename = os.path.basename(filepath)
+            transcript_filename = filename.rsplit('.', 1)[0] + ".txt"
+            intermediate_filepath = os.path.join(intermediate_dir, transcript_filename)
+            if skip_existing and \
+                    (existing_stems is None or filename.rsplit('.', 1)[0] in existing_stems) and \
+                    is_transcript_done(transcript_filename, intermediate_filepath):
                 processed_count += 1
+                skipped_count += 1
+                success_count += 1
                 current_count = processed_count
-            error_msg = f"({current_count}/{len(audio_files)}) 处理 {filename} 时发生错误: {e}"
-            update_progress(error_msg)
+                update_progress(f"({current_count}/{total_display}) 跳过已存在的转录: {filename}")
+            else:
+                pending.append(filepath)
+        if not pending:
+            return "SKIPPED"
+
+        try:
+            batch_results = await process_audio_batch(pending, client, intermediate_dir, system_instruction, model_name)
+        except Exception as e:
+            processed_count += len(pending)
+            current_count = processed_count
+            update_progress(f"({current_count}/{total_display}) 批量处理失败 ({len(pending)} 个切片): {e}")
             return ""
 
-    # 根据文件数调整工作线程数，避免创建过多线程
-    actual_workers = min(max_workers, len(audio_files))
-    if actual_workers < max_workers:
-        update_progress(f"文件数量为 {len(audio_files)}，调整并行数为 {actual_workers}")
+        for filepath in pending:
+            filename = os.path.basename(filepath)
+            processed_count += 1
+            current_count = processed_count
+            if batch_results.get(filepath):
+                success_count += 1
+                transcript_filename = filename.rsplit('.', 1)[0] + ".txt"
+                record_done(transcript_filename, os.path.join(intermediate_dir, transcript_filename))
+                status_msg = f"({current_count}/{total_display}) 成功处理: {filename}"
+            else:
+                status_msg = f"({current_count}/{total_display}) 处理完成但未生成有效转录: {filename}"
+            update_progress(status_msg)
+        return "BATCH"
+
+    # 根据文件数调整并发数（流式模式下文件数未知，直接使用 max_workers）
+    if streaming:
+        actual_workers = max_workers
+        update_progress(f"流式转录模式：等待上游切片，使用最多 {actual_workers} 个并行请求...")
     else:
-        update_progress(f"开始处理 {len(audio_files)} 个音频文件，使用 {actual_workers} 个并行请求...")
-    
-    # 如果启用了跳过功能，报告可能跳过的文件
-    if skip_existing:
-        existing_files = sum(1 for f in audio_files if is_valid_transcript_file(
-            os.path.join(intermediate_dir, pathlib.Path(os.path.basename(f)).stem + ".txt")))
-        if existing_files > 0:
-            update_progress(f"检测到 {existing_files} 个有效的现有转录文件，将被跳过处理。")
+        actual_workers = min(max_workers, len(audio_files))
+        if actual_workers < max_workers:
+            update_progress(f"文件数量为 {len(audio_files)}，调整并行数为 {actual_workers}")
+        else:
+            update_progress(f"开始处理 {len(audio_files)} 个音频文件，使用 {actual_workers} 个并行请求...")
+
+    # 如果启用了跳过功能，报告可能跳过的文件（流式模式下跳过检查由各工作线程自行完成）
+    # 已有中间文件的主名集合。非流式模式下预扫描填充；工作协程用它与
+    # 音频文件主名做集合相交——不在集合里的文件必然未完成，直接开始转录，
+    # 连 stat/清单查询都省掉（None 表示未知，退回逐文件检查）
+    existing_stems = None
+    if skip_existing and not streaming:
+        # 一次 scandir 收集已有非空 .txt 的主名集合，预扫描只做集合成员判断，
+        # 不逐个打开读取；逐文件的内容有效性检查留给各工作协程并行完成
+        try:
+            with os.scandir(intermediate_dir) as dir_iter:
+                existing_stems = {entry.name[:-4] for entry in dir_iter
+                                  if entry.name.endswith('.txt') and entry.stat().st_size > 0}
+        except OSError:
+            existing_stems = None
+        if existing_stems:
+            existing_files = sum(1 for f in audio_files
+                                 if os.path.basename(f).rsplit('.', 1)[0] in existing_stems)
+            if existing_files > 0:
+                update_progress(f"检测到 {existing_files} 个已存在的转录文件，其中有效者将被跳过处理。")
 
     # 开始计时
     start_time = time.time()
     results = []
 
-    # 使用线程池进行并行处理
+    # 异步并发执行：每个文件/批次一个协程，用信号量限制同时在途的请求数。
+    # 协程只在等待网络时让出，数千个并发任务的内存开销也只有每个几KB
+    async def _run_all():
+        semaphore = asyncio.Semaphore(actual_workers)
+
+        async def _bounded(coro):
+            async with semaphore:
+                return await coro
+
+        tasks = []
+        if streaming:
+            # 边消费队列边创建任务：切片一就绪就开始转录，与上游切分过程重叠。
+            # 队列来自切分线程，用 to_thread 等待以免阻塞事件循环
+            while True:
+                filepath = await asyncio.to_thread(chunk_queue.get)
+                if filepath is None: # 结束哨兵：上游切分已完成
+                    break
+                audio_files.append(filepath)
+                tasks.append(asyncio.create_task(_bounded(process_file_with_progress(filepath))))
+        elif batch_size > 1:
+            # 批量模式：按 batch_size 分组，每组一次 generate_content 请求
+            batches = [audio_files[i:i + batch_size] for i in range(0, len(audio_files), batch_size)]
+            update_progress(f"批量模式：{len(audio_files)} 个文件分为 {len(batches)} 批，每批最多 {batch_size} 个。")
+            tasks = [asyncio.create_task(_bounded(process_batch_with_progress(batch)))
+                     for batch in batches]
+        else:
+            tasks = [asyncio.create_task(_bounded(process_file_with_progress(filepath)))
+                     for filepath in audio_files]
+
+        # 按完成顺序收集结果（进度更新已在各任务内完成）
+        for completed in asyncio.as_completed(tasks):
+            try:
+                results.append(await completed)
+            except Exception as exc:
+                # 任务执行中的异常应该在process_file_with_progress中处理，
+                # 这里兜底捕获意外逃逸的异常
+                update_progress(f"转录任务执行时发生意外错误: {exc}")
+
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=actual_workers) as executor:
-            # 提交所有任务
-            future_to_filepath = {
-                executor.submit(process_file_with_progress, filepath): filepath
-                for filepath in audio_files
-            }
-            
-            # 按完成顺序收集结果
-            for future in concurrent.futures.as_completed(future_to_filepath):
-                try:
-                    result = future.result()
-                    results.append(result)
-                except Exception as exc:
-                    # 这里捕获的是submit过程中的异常，而不是任务执行中的异常
-                    # 任务执行中的异常应该在process_file_with_progress中处理
-                    filepath = future_to_filepath[future]
-                    error_msg = f"提交任务 {os.path.basename(filepath)} 时发生意外错误: {exc}"
-                    update_progress(error_msg)
+        asyncio.run(_run_all())
     except Exception as e:
-        # 处理线程池本身的异常
+        # 处理事件循环本身的异常
         error_msg = f"并行处理过程中发生严重错误: {e}"
         update_progress(error_msg)
+        save_manifest() # 保留已完成部分的清单，便于下次续传
         return False
 
     # 计算总时间
@@ -394,6 +942,9 @@ def run_transcription(api_key, audio_dir, intermediate_dir, system_instruction=S
                   f"(其中跳过: {skipped_count}，新处理: {success_count - skipped_count})。"
                   f"总耗时: {total_time:.2f} 秒。")
     update_progress(summary_msg)
+
+    # 持久化已完成清单，供下次启动 O(1) 跳过
+    save_manifest()
     
     # 只要代码能运行到这里，就认为整体过程是成功的
     # 即使部分文件可能失败，后续的合并步骤仍可以处理成功的文件
@@ -412,6 +963,10 @@ if __name__ == "__main__":
     parser.add_argument("--model-name", default=DEFAULT_MODEL, help=f"使用的 Gemini 模型名称 (默认: {DEFAULT_MODEL})")
     parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
                       help=f"最大并行请求数 (默认: {DEFAULT_MAX_WORKERS})。注意API速率限制。")
+    parser.add_argument("--batch-size", type=int, default=1,
+                      help="每次请求携带的切片数 (默认: 1)。>1 时多个切片合并为一次请求，摊薄请求开销。")
+    parser.add_argument("--cleanup-uploads", action="store_true",
+                      help="转录后立即删除通过 Files API 上传的文件 (默认不删除，由服务端48小时后自动过期)")
 
     args = parser.parse_args()
 
@@ -425,5 +980,7 @@ if __name__ == "__main__":
         intermediate_dir=args.intermediate_dir,
         system_instruction=system_instruction,
         model_name=args.model_name,
-        max_workers=args.max_workers  # 传递并行数
+        max_workers=args.max_workers,  # 传递并行数
+        batch_size=args.batch_size,  # 传递批量大小
+        cleanup_uploads=args.cleanup_uploads  # 是否立即删除上传文件
     )
\ No newline at end of file
@@ -1,55 +1,208 @@
 import os
 import subprocess
 import argparse
+import json
 import sys
+import shutil
+import math
 import time
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 可选的快速时长读取库：tinytag 只读 MP3 的 Xing/VBRI 头或扫描帧头
+# （纯 Python、少量 seek、不解码、不起子进程），未安装时自动退回 ffprobe
+try:
+    from tinytag import TinyTag
+except ImportError:
+    TinyTag = None
+
+# 可选的 C 实现 JSON 解析器：批量模式下 ffprobe 的 JSON 输出可能有几 KB 到几 MB，
+# orjson 解析比标准库快一个量级；未安装时退回标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选的进度条：tqdm 自带限速刷新，省掉每迭代一次的取模判断和时钟调用；
+# 未安装时退回每 50 个切片打印一行的方式
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+_FAST_DURATION_EXTS = ('.mp3', '.m4a', '.wav', '.flac')
+
+def _fast_duration(input_file):
+    """用 tinytag 从容器头直接读取时长（秒），不可用或解析失败时返回 None"""
+    if TinyTag is None or not input_file.lower().endswith(_FAST_DURATION_EXTS):
+        return None
+    try:
+        duration = TinyTag.get(input_file).duration
+        return float(duration) if duration else None
+    except Exception:
+        return None
+
+# 限制同时存活的 ffprobe 子进程数，与线程池大小解耦：即使 --workers 设得很大，
+# 子进程并发也不会超过此上限，避免大切片集下内存/文件描述符被耗尽。
+# 可通过环境变量 PROBE_WORKERS 调整，默认为 CPU 核心数
+_PROBE_SEM = threading.BoundedSemaphore(int(os.environ.get("PROBE_WORKERS", os.cpu_count() or 4)))
+
+# ffprobe 参数的固定前缀，模块级元组：每次调用只拼接输入路径，
+# 不再重建整个参数列表（并行热路径下减少分配/GC 压力）。
+# 只探测第一条音频流的时长并用无包装的 CSV 输出：
+# format=duration 会让 ffprobe 扫描整个容器的所有流；
+# -probesize/-analyzeduration 把头部扫描限制在 Xing 帧附近，大文件下尤其重要
+_PROBE_CMD_PREFIX = (
+    'ffprobe',
+    '-v', 'error',
+    '-probesize', '32k',
+    '-analyzeduration', '0',
+    '-select_streams', 'a:0',
+    '-show_entries', 'stream=duration',
+    '-of', 'csv=p=0',
+)
 
 # --- 从 split_audio.py 复制或导入 get_audio_duration_ffmpeg ---
 # (这里直接复制过来，确保脚本独立性)
-def get_audio_duration_ffmpeg(input_file):
-    """使用 ffprobe 获取音频时长（秒）"""
-    command = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        input_file
-    ]
+def get_audio_duration_ffmpeg(input_file, cache=None):
+    """获取音频时长（秒）：先查缓存，再读容器头，最后才走 ffprobe 子进程
+
+    cache 是以 "大小:mtime_ns:文件名" 为键的字典（见 main 中的磁盘缓存）：
+    文件未变时重跑只需一次 stat，探测结果写回同一字典
+    """
+    cache_key = None
+    if cache is not None:
+        try:
+            st = os.stat(input_file)
+            cache_key = f"{st.st_size}:{st.st_mtime_ns}:{os.path.basename(input_file)}"
+            if cache_key in cache:
+                return cache[cache_key]
+        except OSError:
+            pass
+    duration = _probe_duration(input_file)
+    if cache_key is not None and duration is not None:
+        cache[cache_key] = duration
+    return duration
+
+def _probe_duration(input_file):
+    """实际探测音频时长：优先纯 Python 读容器头，失败才起 ffprobe 子进程"""
+    # 切分出错可能留下零字节/残缺切片，一次 stat 即可识别，
+    # 不必为注定失败的文件白白起一个 ffprobe 子进程。
+    # 128 字节的下限足以覆盖最小的 MP3 帧头加上精简的 ID3v2 标签
     try:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        stdout_output, stderr_output = process.communicate(timeout=60) # Add timeout
-        if process.returncode != 0:
-             print(f"  错误：ffprobe 获取时长失败 for {os.path.basename(input_file)}. 返回码: {process.returncode}")
-             # print(f"  ffprobe 输出: {stderr_output}") # 可选：打印详细错误
+        if os.stat(input_file).st_size < 128:
+            print(f"  警告：文件过小（不足 128 字节），跳过探测: {os.path.basename(input_file)}")
+            return None
+    except OSError:
+        pass
+    # 快速路径是微秒级的头部解析；ffprobe 每次调用要付出几十毫秒的进程启动开销
+    fast = _fast_duration(input_file)
+    if fast is not None:
+        return fast
+    command = (*_PROBE_CMD_PREFIX, input_file)
+    duration_str = b""
+    try:
+        # subprocess.run 自带超时杀进程；输出只有十几个字节的数字，
+        # 按 bytes 读取省去 universal_newlines 的按区域解码，stderr 本就不打印，直接丢弃。
+        # 注意：不要给这里加 preexec_fn 或改动 close_fds——保持现状 CPython 才会用
+        # posix_spawn 启动子进程，避免 fork 复制整个父进程页表的开销
+        with _PROBE_SEM:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    stdin=subprocess.DEVNULL, timeout=60)
+        if result.returncode != 0:
+             print(f"  错误：ffprobe 获取时长失败 for {os.path.basename(input_file)}. 返回码: {result.returncode}")
              return None
         # 尝试去除可能的空行或无效输出
-        duration_str = stdout_output.strip()
+        duration_str = result.stdout.strip()
         if not duration_str:
              print(f"  错误：ffprobe for {os.path.basename(input_file)} 返回了空输出。")
              return None
-        return float(duration_str)
+        return float(duration_str.decode('ascii'))
     except FileNotFoundError:
         print("错误: ffprobe 命令未找到。请确保 ffmpeg (包含 ffprobe) 已安装并添加到系统 PATH。")
         return None # 返回 None 表示失败
     except subprocess.TimeoutExpired:
         print(f"错误：ffprobe 获取时长超时: {os.path.basename(input_file)}")
-        if process:
-            process.kill()
         return None
-    except ValueError:
-         print(f"错误：无法将 ffprobe 的输出 '{stdout_output.strip()}' 转换为浮点数 for {os.path.basename(input_file)}。")
+    except (ValueError, UnicodeDecodeError):
+         print(f"错误：无法将 ffprobe 的输出 '{duration_str!r}' 转换为浮点数 for {os.path.basename(input_file)}。")
          return None
     except Exception as e:
         print(f"错误：使用 ffprobe 获取 {os.path.basename(input_file)} 时长时发生未知错误: {e}")
         return None
 # -------------------------------------------------------------
 
+def get_total_duration_batched(chunk_paths):
+    """用 concat 解复用器让单次 ffprobe 调用返回全部切片的总时长（秒）。
+
+    逐文件探测每次都要付出一遍 fork+exec+动态链接的进程启动开销，
+    切片很多时这部分远超实际探测时间；批量模式把整个目录压缩为
+    一次子进程调用。失败时返回 None，由调用方退回逐文件探测。
+    """
+    list_path = None
+    try:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False,
+                                         encoding='utf-8') as f_list:
+            list_path = f_list.name
+            for p in chunk_paths:
+                # concat 列表的单引号转义规则：' -> '\''
+                escaped = os.path.abspath(p).replace("'", "'\\''")
+                f_list.write(f"file '{escaped}'\n")
+        command = [
+            'ffprobe', '-v', 'error',
+            '-f', 'concat', '-safe', '0',
+            '-show_entries', 'format=duration',
+            '-of', 'json',
+            list_path
+        ]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                stdin=subprocess.DEVNULL, timeout=600)
+        if result.returncode != 0:
+            print(f"  错误：批量 ffprobe 失败。返回码: {result.returncode}")
+            return None
+        if not result.stdout.strip():
+            print("  错误：批量 ffprobe 返回了空输出。")
+            return None
+        # JSON 输出按 bytes 直接交给解析器，orjson 可用时走 C 路径
+        if orjson is not None:
+            payload = orjson.loads(result.stdout)
+        else:
+            payload = json.loads(result.stdout)
+        duration_str = payload.get('format', {}).get('duration')
+        if not duration_str:
+            print("  错误：批量 ffprobe 输出中没有时长字段。")
+            return None
+        return float(duration_str)
+    except FileNotFoundError:
+        print("错误: ffprobe 命令未找到。请确保 ffmpeg (包含 ffprobe) 已安装并添加到系统 PATH。")
+        return None
+    except subprocess.TimeoutExpired:
+        print("错误：批量 ffprobe 探测超时。")
+        return None
+    except (ValueError, OSError) as e:
+        print(f"错误：批量 ffprobe 探测失败: {e}")
+        return None
+    finally:
+        if list_path:
+            try:
+                os.remove(list_path)
+            except OSError:
+                pass
+
 def main():
     parser = argparse.ArgumentParser(description="比较原始音频文件时长与所有切片时长之和。")
     parser.add_argument("--original-file", required=True, help="原始音频文件路径 (例如 rust.mp3)")
     parser.add_argument("--chunk-dir", required=True, help="包含音频切片的目录 (例如 temp_audio_chunks_new_api)")
     parser.add_argument("--chunk-prefix", default="chunk_", help="切片文件名的前缀 (默认: chunk_)")
     parser.add_argument("--chunk-ext", default=".mp3", help="切片文件的扩展名 (默认: .mp3)")
+    parser.add_argument("--workers", type=int, default=min(32, (os.cpu_count() or 4) * 4),
+                        help="并发 ffprobe 数量 (默认: min(32, CPU核心数*4))")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="切片时长累计超出原始时长 1 秒即提前退出，不再探测剩余切片")
+    parser.add_argument("--batched", action="store_true",
+                        help="单次 ffprobe 调用计算总时长（concat 解复用器），省去逐文件进程开销；"
+                             "但无法报告单个失败切片")
 
     args = parser.parse_args()
 
@@ -67,41 +220,104 @@ def main():
     chunk_count = 0
     failed_chunks = 0
 
+    # os.scandir 一次遍历即可完成过滤并带回缓存的 inode，不必像 listdir
+    # 那样先整体物化再在 Python 层过滤。按 inode 排序让后续打开文件时
+    # 顺着磁盘元数据布局走（机械盘上减少寻道）；时长求和与顺序无关，
+    # 不需要按文件名排序
     try:
-        files_in_dir = os.listdir(args.chunk_dir)
+        with os.scandir(args.chunk_dir) as dir_iter:
+            entries = [(e.path, e.inode()) for e in dir_iter
+                       if e.is_file()
+                       and e.name.startswith(args.chunk_prefix)
+                       and e.name.endswith(args.chunk_ext)]
     except FileNotFoundError:
         print(f"错误：找不到切片目录 '{args.chunk_dir}'。")
         sys.exit(1)
 
-    # 过滤并排序切片文件
-    chunk_files = sorted([
-        f for f in files_in_dir
-        if f.startswith(args.chunk_prefix) and f.endswith(args.chunk_ext)
-    ])
+    # DirEntry.path 本身就是完整路径，直接取出即可——不再维护一份文件名
+    # 列表再逐个 os.path.join 重建路径；告警打印时才取 basename
+    entries.sort(key=lambda t: t[1])
+    chunk_paths = [path for path, _ in entries]
 
-    if not chunk_files:
+    if not chunk_paths:
         print("错误：在指定目录中未找到匹配的切片文件。")
         sys.exit(1)
 
-    print(f"找到 {len(chunk_files)} 个切片文件，开始计算总时长...")
+    print(f"找到 {len(chunk_paths)} 个切片文件，开始计算总时长...")
 
+    # ffprobe 调用是 子进程/IO 密集型，逐个串行时瓶颈在进程启动延迟而非 CPU，
+    # 用线程池一次性提交全部切片并行探测；求和与完成顺序无关
     start_time = time.time()
-    for i, filename in enumerate(chunk_files):
-        filepath = os.path.join(args.chunk_dir, filename)
-        duration = get_audio_duration_ffmpeg(filepath)
-        if duration is not None and duration > 0: # 确保时长有效
-            total_chunk_duration += duration
-            chunk_count += 1
-        else:
-            print(f"  警告：无法获取或获取到无效时长 for chunk: {filename}。已跳过。")
-            failed_chunks += 1
 
-        # 打印进度
-        if (i + 1) % 50 == 0 or (i + 1) == len(chunk_files):
-             elapsed = time.time() - start_time
-             print(f"  已处理 {i + 1}/{len(chunk_files)} 个切片... (耗时: {elapsed:.2f}s)")
+    # 批量模式：整个目录一次 ffprobe 调用拿到总时长，失败则退回逐文件探测
+    if args.batched:
+        batched_total = get_total_duration_batched(chunk_paths)
+        if batched_total is not None:
+            total_chunk_duration = batched_total
+            chunk_count = len(chunk_paths)
+            print(f"  批量探测完成。 (耗时: {time.time() - start_time:.2f}s)")
+            _report(args, original_duration, total_chunk_duration, chunk_count, failed_chunks)
+            return
+        print("  批量探测失败，退回逐文件探测。")
 
+    # 磁盘时长缓存：键为 "大小:mtime_ns:文件名"，文件未变时重跑直接命中，
+    # 整个验证退化为每文件一次 stat（调整切分参数后的反复验证受益最大）
+    cache_path = os.path.join(args.chunk_dir, ".duration_cache.json")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f_cache:
+            duration_cache = json.load(f_cache)
+    except (OSError, ValueError):
+        duration_cache = {}
+
+    done = 0
+    durations = [] # 先收集再一次 math.fsum：几千个浮点数逐项 += 会累积舍入误差
+    running_total = 0.0 # 仅用于 --fail-fast 的超量判断，最终求和仍用 fsum
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        future_to_path = {executor.submit(get_audio_duration_ffmpeg, p, duration_cache): p
+                          for p in chunk_paths}
+        completed = as_completed(future_to_path)
+        if tqdm is not None:
+            completed = tqdm(completed, total=len(chunk_paths), desc="探测时长", unit="chunk")
+        for future in completed:
+            filepath = future_to_path[future]
+            duration = future.result()
+            if duration is not None and duration > 0: # 确保时长有效
+                durations.append(duration)
+                running_total += duration
+                # 结论已注定是"显著大于"，剩余探测只是浪费子进程
+                if args.fail_fast and running_total - original_duration > 1.0:
+                    print(f"  提前退出：切片总时长已超出原始时长 "
+                          f"{running_total - original_duration:.2f} 秒，跳过剩余切片。")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+            else:
+                print(f"  警告：无法获取或获取到无效时长 for chunk: {os.path.basename(filepath)}。已跳过。")
+                failed_chunks += 1
+
+            # 打印进度（tqdm 可用时由进度条代劳）
+            if tqdm is None:
+                done += 1
+                if done % 50 == 0 or done == len(chunk_paths):
+                    elapsed = time.time() - start_time
+                    print(f"  已处理 {done}/{len(chunk_paths)} 个切片... (耗时: {elapsed:.2f}s)")
+
+
+    total_chunk_duration = math.fsum(durations)
+    chunk_count = len(durations)
 
+    # 原子保存缓存（临时文件 + 重命名），半成品不会破坏已有缓存
+    try:
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f_cache:
+            json.dump(duration_cache, f_cache)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"  提示：无法保存时长缓存: {e}")
+
+    _report(args, original_duration, total_chunk_duration, chunk_count, failed_chunks)
+
+def _report(args, original_duration, total_chunk_duration, chunk_count, failed_chunks):
+    """打印最终的时长比较结果（逐文件与批量模式共用）"""
     print("\n--- 结果 ---")
     print(f"原始文件 ({os.path.basename(args.original_file)}) 时长: {original_duration:.6f} 秒")
     print(f"成功处理的切片数量: {chunk_count}")
@@ -120,10 +336,8 @@ def main():
         print("警告：总切片时长显著小于原始时长，这可能导致累积计时误差（字幕超前）。")
 
 if __name__ == "__main__":
-    # 检查 ffprobe 是否可用
-    try:
-        subprocess.run(['ffprobe', '-version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+    # 检查 ffprobe 是否可用：shutil.which 只查 PATH，不用再额外起一个子进程
+    if shutil.which('ffprobe') is None:
         print("错误：ffprobe 未找到或无法执行。请确保 ffmpeg (包含 ffprobe) 已正确安装并添加到系统 PATH。")
         sys.exit(1)
     main()
\ No newline at end of file